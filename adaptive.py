@@ -0,0 +1,156 @@
+import os
+import threading
+from collections import deque
+
+import chunked_transcription
+
+# Desative (ADAPTIVE_QUALITY=false) para sempre usar o modelo e o beam pedidos
+ADAPTIVE_QUALITY = os.environ.get('ADAPTIVE_QUALITY', 'true').lower() == 'true'
+
+# Tempo máximo desejado (s) entre o upload e o fim da transcrição
+LATENCY_SLO_SECONDS = float(os.environ.get('LATENCY_SLO_SECONDS', 120))
+
+# Menor modelo para o qual a política pode rebaixar um job
+ADAPTIVE_MIN_MODEL = os.environ.get('ADAPTIVE_MIN_MODEL', 'small')
+
+# Modelos do mais preciso para o mais rápido
+MODEL_LADDER = ['large-v3', 'large-v2', 'large-v1', 'medium', 'small', 'base', 'tiny']
+
+# Fator de tempo real inicial (tempo de transcrição / duração, com beam 5) antes de haver medições
+DEFAULT_RTF = {
+    'tiny': 0.03,
+    'base': 0.05,
+    'small': 0.1,
+    'medium': 0.25,
+    'large-v1': 0.5,
+    'large-v2': 0.5,
+    'large-v3': 0.5,
+}
+
+DEFAULT_BEAM_SIZE = 5
+
+# Duração (s) presumida de um áudio enquanto não há medições (mensagem de voz típica)
+DEFAULT_AUDIO_SECONDS = 30.0
+
+# Medições recentes consideradas por modelo
+RTF_WINDOW = 50
+
+# Peso das novas medições nas médias móveis exponenciais
+EWMA_ALPHA = 0.2
+
+
+def beam_factor(beam_size):
+    """Custo relativo do beam search em relação ao beam 5 (beam 1 custa cerca de 60%)."""
+    beam_size = int(beam_size or DEFAULT_BEAM_SIZE)
+    return 0.6 + 0.1 * (min(beam_size, 10) - 1)
+
+
+def chunk_parallelism(audio_seconds):
+    """Trechos transcritos ao mesmo tempo para um áudio dessa duração."""
+    if audio_seconds <= chunked_transcription.LONG_AUDIO_SECONDS:
+        return 1
+    chunks = max(1, int(audio_seconds // chunked_transcription.MIN_CHUNK_SECONDS))
+    return max(1, min(chunked_transcription.chunk_worker_count(), chunks))
+
+
+class AdaptivePolicy:
+    """Rebaixa modelo/beam quando a fila ameaça o SLO de latência e restaura a qualidade quando a carga cai."""
+
+    def __init__(self, slo_seconds=LATENCY_SLO_SECONDS, min_model=ADAPTIVE_MIN_MODEL, window=RTF_WINDOW):
+        self.slo_seconds = slo_seconds
+        self.min_model = min_model
+        self._rtf = {}  # modelo -> deque de RTFs normalizados para beam 5
+        self._window = window
+        self._audio_seconds = DEFAULT_AUDIO_SECONDS
+        self._service_seconds = None
+        self._lock = threading.Lock()
+
+    def observe(self, model, beam_size, elapsed_seconds, audio_seconds):
+        """Registra uma transcrição concluída (tempo gasto e duração do áudio)."""
+        if audio_seconds <= 0:
+            return
+        with self._lock:
+            samples = self._rtf.setdefault(model, deque(maxlen=self._window))
+            samples.append(elapsed_seconds / audio_seconds / beam_factor(beam_size))
+            self._audio_seconds += EWMA_ALPHA * (audio_seconds - self._audio_seconds)
+
+    def observe_job(self, service_seconds):
+        """Registra o tempo total de um job no worker (decodificação, modelo e pós-processamento)."""
+        with self._lock:
+            if self._service_seconds is None:
+                self._service_seconds = service_seconds
+            else:
+                self._service_seconds += EWMA_ALPHA * (service_seconds - self._service_seconds)
+
+    def rtf_for(self, model, beam_size=None):
+        """Fator de tempo real esperado: mediana das medições recentes ou a estimativa inicial."""
+        with self._lock:
+            samples = sorted(self._rtf.get(model, ()))
+        base = samples[len(samples) // 2] if samples else DEFAULT_RTF.get(model, DEFAULT_RTF['large-v2'])
+        return base * beam_factor(beam_size)
+
+    def candidates(self, config):
+        """Configurações possíveis, da pedida até a mais barata permitida."""
+        model = config.get('model') or 'medium'
+        steps = [config]
+        if int(config.get('beam_size') or DEFAULT_BEAM_SIZE) > 1:
+            steps.append({**config, 'beam_size': '1'})
+        if model not in MODEL_LADDER or self.min_model not in MODEL_LADDER:
+            return steps
+        for smaller in MODEL_LADDER[MODEL_LADDER.index(model) + 1:MODEL_LADDER.index(self.min_model) + 1]:
+            steps.append({**config, 'model': smaller, 'beam_size': '1'})
+        return steps
+
+    def processing_seconds(self, config, audio_seconds):
+        """Tempo de transcrição do áudio com a configuração dada, com a fila vazia.
+
+        Áudios longos são divididos em trechos transcritos em paralelo (chunked_transcription).
+        """
+        rtf = self.rtf_for(config.get('model') or 'medium', config.get('beam_size'))
+        return audio_seconds * rtf / chunk_parallelism(audio_seconds)
+
+    def estimate_latency(self, config, queue_depth, workers, audio_seconds=None):
+        """Espera estimada na fila mais o tempo de transcrição deste áudio com a configuração dada."""
+        with self._lock:
+            typical_audio = self._audio_seconds
+            service = self._service_seconds
+        if audio_seconds is None:
+            audio_seconds = typical_audio
+        if service is None:
+            service = self.processing_seconds(config, typical_audio)
+        wait = queue_depth / max(1, workers) * service
+        return wait + self.processing_seconds(config, audio_seconds)
+
+    def choose(self, config, queue_depth, workers, audio_seconds=None):
+        """Devolve (configuração efetiva, latência estimada): a de maior qualidade que cabe no SLO.
+
+        O SLO limita o atraso causado pela fila: o tempo que o próprio áudio levaria com a fila vazia
+        não conta, então arquivos longos não são rebaixados só por serem longos, e com a fila vazia a
+        configuração pedida é sempre usada. Quando nenhuma cabe, usa a mais barata permitida.
+        """
+        if audio_seconds is None:
+            with self._lock:
+                audio_seconds = self._audio_seconds
+        if queue_depth <= 0:
+            return config, self.estimate_latency(config, queue_depth, workers, audio_seconds)
+
+        budget = self.slo_seconds + self.processing_seconds(config, audio_seconds)
+        steps = self.candidates(config)
+        for step in steps:
+            estimate = self.estimate_latency(step, queue_depth, workers, audio_seconds)
+            if estimate <= budget:
+                return step, estimate
+        return steps[-1], self.estimate_latency(steps[-1], queue_depth, workers, audio_seconds)
+
+    def stats(self):
+        with self._lock:
+            models = {model: round(sorted(samples)[len(samples) // 2], 4)
+                      for model, samples in self._rtf.items() if samples}
+            return {
+                "enabled": ADAPTIVE_QUALITY,
+                "slo_seconds": self.slo_seconds,
+                "min_model": self.min_model,
+                "typical_audio_seconds": round(self._audio_seconds, 2),
+                "service_seconds": round(self._service_seconds, 2) if self._service_seconds is not None else None,
+                "median_rtf_beam5": models
+            }
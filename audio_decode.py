@@ -0,0 +1,61 @@
+import logging
+import subprocess
+import wave
+
+import numpy as np
+
+import media_probe
+
+# Taxa de amostragem esperada pelo Whisper (mono)
+SAMPLE_RATE = 16000
+
+
+def read_wav_pcm(media_path, sample_rate=SAMPLE_RATE):
+    """PCM de um WAV que já está no formato esperado (mono, 16 bits, sample_rate); None caso contrário."""
+    try:
+        with wave.open(media_path, 'rb') as wav_file:
+            if (wav_file.getnchannels(), wav_file.getsampwidth(), wav_file.getframerate()) != (1, 2, sample_rate):
+                return None
+            return np.frombuffer(wav_file.readframes(wav_file.getnframes()), dtype=np.int16)
+    except (wave.Error, EOFError):
+        return None
+
+
+def decode_pcm(media_path, sample_rate=SAMPLE_RATE):
+    """Decodifica o áudio de qualquer arquivo para PCM int16 mono via pipe do ffmpeg, sem arquivos intermediários."""
+    # WAVs já decodificados (ex.: os de /download_and_transcribe) são lidos direto, sem o ffmpeg
+    if media_path.lower().endswith('.wav'):
+        pcm = read_wav_pcm(media_path, sample_rate)
+        if pcm is not None:
+            return pcm
+    command = [
+        'ffmpeg', '-nostdin', '-v', 'error',
+        '-i', media_path,
+        '-vn', '-ac', '1', '-ar', str(sample_rate),
+        '-f', 's16le', '-'
+    ]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return np.frombuffer(result.stdout, dtype=np.int16)
+
+
+def probe_duration(media_path):
+    """Duração da mídia em segundos, lida do contêiner pelo ffprobe; None se não for possível obtê-la."""
+    try:
+        return media_probe.probe(media_path).duration or None
+    except (OSError, subprocess.CalledProcessError, ValueError) as e:
+        logging.warning(f"Não foi possível obter a duração de {media_path}: {e}")
+        return None
+
+
+def pcm_to_float32(pcm):
+    """Converte PCM int16 para float32 no intervalo [-1, 1], formato aceito pelo faster-whisper."""
+    return pcm.astype(np.float32) / 32768.0
+
+
+def write_wav(wav_path, pcm, sample_rate=SAMPLE_RATE):
+    """Grava PCM int16 mono em um arquivo WAV."""
+    with wave.open(wav_path, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(np.ascontiguousarray(pcm, dtype=np.int16).tobytes())
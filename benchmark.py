@@ -0,0 +1,243 @@
+"""Benchmark offline dos backends de transcrição sobre uma matriz de configurações.
+
+Exemplo:
+    python benchmark.py --corpus audios_benchmark --synthetic 10,60 \\
+        --models small,medium --beam-sizes 1,5 --torch-dtypes float16,int8 \\
+        --repeats 3 --output-json bench.json --output-csv bench.csv
+
+Cada configuração roda em um processo novo, para que o pico de memória (RSS) e o tempo de CPU
+medidos sejam só dela. A primeira transcrição de cada configuração (aquecimento, que inclui a
+carga do modelo) é descartada das estatísticas, a menos que --warmup 0 seja usado.
+"""
+import os
+import csv
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import itertools
+import tempfile
+import multiprocessing
+
+import numpy as np
+
+import timing
+import whisper_backend
+from audio_decode import SAMPLE_RATE, decode_pcm, write_wav
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:  # Opcional; usado para o pico de memória no Windows
+    psutil = None
+
+# Formatos lidos do corpus
+AUDIO_EXTENSIONS = ['.wav', '.mp3', '.aac', '.ogg', '.opus', '.m4a', '.mp4', '.mkv', '.avi', '.webm']
+
+LATENCY_PERCENTILES = (50, 90, 95, 99)
+
+CSV_FIELDS = ['model', 'beam_size', 'chunk_length', 'torch_dtype', 'file', 'audio_seconds', 'repeat',
+              'latency_seconds', 'model_load_seconds', 'inference_seconds', 'real_time_factor',
+              'cpu_seconds', 'error']
+
+
+def generate_synthetic(seconds, path, seed=0):
+    """Gera um WAV 16 kHz mono com rajadas de ruído modulado separadas por pausas, imitando o ritmo da fala.
+
+    Serve para medir desempenho sem depender de um corpus; o texto transcrito não tem significado.
+    """
+    rng = np.random.default_rng(seed)
+    samples = int(seconds * SAMPLE_RATE)
+    t = np.arange(samples) / SAMPLE_RATE
+    # Envelope de sílabas (~4 Hz) com pausas de 0,5 s a cada 2 s
+    envelope = 0.5 * (1 + np.sin(2 * np.pi * 4 * t))
+    envelope[(t % 2.0) > 1.5] = 0.0
+    signal = rng.normal(0, 0.2, samples) * envelope + 0.1 * np.sin(2 * np.pi * 180 * t) * envelope
+    pcm = (np.clip(signal, -1, 1) * 32767).astype(np.int16)
+    write_wav(path, pcm)
+    return path
+
+
+def collect_corpus(corpus_dir, synthetic_seconds, work_dir):
+    """Lista os arquivos do corpus e gera os sintéticos pedidos."""
+    files = []
+    if corpus_dir:
+        for root, _, names in os.walk(corpus_dir):
+            for name in sorted(names):
+                if os.path.splitext(name)[-1].lower() in AUDIO_EXTENSIONS:
+                    files.append(os.path.join(root, name))
+    for seconds in synthetic_seconds:
+        files.append(generate_synthetic(seconds, os.path.join(work_dir, f'synthetic_{seconds:g}s.wav')))
+    return files
+
+
+def build_matrix(models, beam_sizes, chunk_lengths, torch_dtypes):
+    """Produto cartesiano das opções; None significa o padrão do backend."""
+    return [
+        {'model': model, 'beam_size': beam_size, 'chunk_length': chunk_length, 'torch_dtype': torch_dtype}
+        for model, beam_size, chunk_length, torch_dtype
+        in itertools.product(models, beam_sizes, chunk_lengths, torch_dtypes)
+    ]
+
+
+def peak_rss_mb():
+    """Pico de memória residente do processo atual e dos filhos já encerrados (MB), quando disponível."""
+    if resource is not None:
+        # ru_maxrss é em KB no Linux e em bytes no macOS
+        scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+        own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+        return round(own, 1), round(children, 1)
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return round(getattr(info, 'peak_wset', info.rss) / (1024 * 1024), 1), None
+    return None, None
+
+
+def cpu_seconds():
+    """Tempo de CPU (usuário + sistema) do processo e dos filhos encerrados, como o executável."""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def run_config(config, files, backend, executable, repeats, warmup, work_dir):
+    """Executado em um processo próprio: transcreve todos os arquivos com uma configuração."""
+    whisper_backend.TRANSCRIPTION_BACKEND = backend
+    runs = []
+    for path in files:
+        pcm = decode_pcm(path)
+        audio_seconds = len(pcm) / SAMPLE_RATE
+        for repeat in range(warmup + repeats):
+            output_dir = tempfile.mkdtemp(prefix='bench_', dir=work_dir)
+            timer = timing.StageTimer()
+            cpu_start = cpu_seconds()
+            start = time.perf_counter()
+            error = None
+            try:
+                with timing.activate(timer):
+                    whisper_backend.transcribe_pcm(pcm, 'bench', output_dir, config, executable, output_dir)
+            except Exception as e:
+                error = str(e)
+            latency = time.perf_counter() - start
+            cpu = cpu_seconds() - cpu_start
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+            stages = timer.to_dict()['stages']
+            runs.append({
+                **config,
+                'file': os.path.basename(path),
+                'audio_seconds': round(audio_seconds, 3),
+                'repeat': repeat - warmup,  # negativo = aquecimento
+                'latency_seconds': round(latency, 4),
+                'model_load_seconds': stages.get('model_load', 0.0),
+                'inference_seconds': stages.get('inference', 0.0),
+                'real_time_factor': round(latency / audio_seconds, 4) if audio_seconds else None,
+                'cpu_seconds': round(cpu, 4),
+                'error': error
+            })
+    own_rss, children_rss = peak_rss_mb()
+    return runs, own_rss, children_rss
+
+
+def summarize(config, runs, own_rss, children_rss):
+    """Estatísticas de uma configuração, ignorando o aquecimento."""
+    measured = [run for run in runs if run['repeat'] >= 0]
+    ok = [run for run in measured if run['error'] is None]
+    summary = {
+        **config,
+        'runs': len(measured),
+        'errors': len(measured) - len(ok),
+        'peak_rss_mb': own_rss,
+        'peak_child_rss_mb': children_rss
+    }
+    if not ok:
+        return summary
+
+    latencies = np.array([run['latency_seconds'] for run in ok])
+    rtfs = np.array([run['real_time_factor'] for run in ok if run['real_time_factor'] is not None])
+    audio = sum(run['audio_seconds'] for run in ok)
+    cpu = sum(run['cpu_seconds'] for run in ok)
+    summary.update({
+        'audio_seconds': round(audio, 3),
+        'real_time_factor': round(float(latencies.sum() / audio), 4) if audio else None,
+        'real_time_factor_p50': round(float(np.percentile(rtfs, 50)), 4) if len(rtfs) else None,
+        'real_time_factor_p95': round(float(np.percentile(rtfs, 95)), 4) if len(rtfs) else None,
+        'cpu_seconds': round(cpu, 3),
+        # CPU por segundo de áudio: acima de 1 indica uso de vários núcleos
+        'cpu_per_audio_second': round(cpu / audio, 4) if audio else None,
+        'latency_mean': round(float(latencies.mean()), 4),
+        'latency_max': round(float(latencies.max()), 4)
+    })
+    for percentile in LATENCY_PERCENTILES:
+        summary[f'latency_p{percentile}'] = round(float(np.percentile(latencies, percentile)), 4)
+    return summary
+
+
+def parse_list(value, cast=str):
+    """'a,b,,c' -> [a, b, None, c]; itens vazios representam o padrão do backend."""
+    return [cast(item) if item else None for item in value.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark dos backends de transcrição sobre uma matriz de configurações.")
+    parser.add_argument('--corpus', help="Pasta com os áudios do corpus (busca recursiva)")
+    parser.add_argument('--synthetic', default='', help="Durações (s) de áudios sintéticos a gerar, ex.: 10,60,300")
+    parser.add_argument('--models', default='medium')
+    parser.add_argument('--beam-sizes', default='', help="Lista separada por vírgulas; vazio = padrão")
+    parser.add_argument('--chunk-lengths', default='', help="Lista separada por vírgulas; vazio = padrão")
+    parser.add_argument('--torch-dtypes', default='', help="Lista separada por vírgulas; vazio = padrão")
+    parser.add_argument('--backend', default=whisper_backend.TRANSCRIPTION_BACKEND, choices=['inprocess', 'subprocess'])
+    parser.add_argument('--executable', default=os.environ.get('FASTER_WHISPER_PATH', 'faster-whisper-xxl.exe'))
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--warmup', type=int, default=1, help="Execuções descartadas por arquivo (inclui a carga do modelo)")
+    parser.add_argument('--no-isolate', action='store_true', help="Roda tudo no processo atual (RSS deixa de ser por configuração)")
+    parser.add_argument('--output-json', help="Grava o resumo e as execuções em JSON")
+    parser.add_argument('--output-csv', help="Grava uma linha por execução em CSV")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+
+    work_dir = tempfile.mkdtemp(prefix='benchmark_')
+    try:
+        files = collect_corpus(args.corpus, parse_list(args.synthetic, float) if args.synthetic else [], work_dir)
+        if not files:
+            parser.error("Nenhum áudio: informe --corpus e/ou --synthetic")
+
+        matrix = build_matrix(parse_list(args.models), parse_list(args.beam_sizes, int),
+                              parse_list(args.chunk_lengths, int), parse_list(args.torch_dtypes))
+        print(f"{len(files)} arquivos x {len(matrix)} configurações x {args.repeats} repetições ({args.backend})")
+
+        summaries, all_runs = [], []
+        context = multiprocessing.get_context('spawn')
+        for config in matrix:
+            call_args = (config, files, args.backend, args.executable, args.repeats, args.warmup, work_dir)
+            if args.no_isolate:
+                runs, own_rss, children_rss = run_config(*call_args)
+            else:
+                with context.Pool(1) as pool:
+                    runs, own_rss, children_rss = pool.apply(run_config, call_args)
+            summary = summarize(config, runs, own_rss, children_rss)
+            summaries.append(summary)
+            all_runs.extend(runs)
+            print(json.dumps(summary, ensure_ascii=False))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output_json:
+        with open(args.output_json, 'w', encoding='utf-8') as f:
+            json.dump({'summary': summaries, 'runs': all_runs}, f, indent=2, ensure_ascii=False)
+    if args.output_csv:
+        with open(args.output_csv, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+            writer.writerows(all_runs)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+import os
+import shutil
+import logging
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pysrt
+
+import vad
+import whisper_backend
+from audio_decode import SAMPLE_RATE
+
+# Áudios (após o VAD) mais longos que isso são divididos e transcritos em paralelo
+LONG_AUDIO_SECONDS = int(os.environ.get('LONG_AUDIO_SECONDS', 600))
+
+# Processos usados na transcrição dos trechos (0 = um por grupo de WHISPER_CPU_THREADS núcleos, limitado pela memória)
+CHUNK_WORKERS = int(os.environ.get('CHUNK_WORKERS', 0))
+
+# Limites do tamanho de cada trecho, em segundos
+MIN_CHUNK_SECONDS = 60
+MAX_CHUNK_SECONDS = 300
+
+# Janela (em segundos) ao redor de cada corte ideal onde procuramos o ponto mais silencioso
+BOUNDARY_SEARCH_SECONDS = 10
+
+# Quadros usados para suavizar a energia antes de escolher o corte
+SMOOTHING_FRAMES = 10
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def chunk_worker_count():
+    """Processos do pool de trechos.
+
+    Cada processo carrega o próprio modelo, então o padrão também é limitado pelo orçamento
+    WHISPER_POOL_MEMORY_MB (de RAM ou da GPU), dividido entre os processos.
+    """
+    if CHUNK_WORKERS:
+        return CHUNK_WORKERS
+    workers = max(1, (os.cpu_count() or 1) // max(1, whisper_backend.WHISPER_CPU_THREADS))
+    model_mb = whisper_backend.estimate_model_size_mb('medium', 'default')
+    return max(1, min(workers, whisper_backend.WHISPER_POOL_MEMORY_MB // model_mb))
+
+
+def _init_chunk_worker(memory_budget_mb):
+    # Os processos dividem o orçamento de memória, em vez de cada um usar o orçamento inteiro
+    whisper_backend.model_pool.memory_budget_mb = memory_budget_mb
+
+
+def get_executor():
+    """Pool de processos compartilhado entre os jobs, para que os modelos carregados sejam reaproveitados."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = chunk_worker_count()
+            # 'spawn' evita herdar por fork as threads e os modelos do processo da API; o módulo principal é
+            # reimportado em cada processo, por isso os serviços da API só iniciam em start_services()
+            _executor = ProcessPoolExecutor(max_workers=workers,
+                                            mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_chunk_worker,
+                                            initargs=(max(1, whisper_backend.WHISPER_POOL_MEMORY_MB // workers),))
+        return _executor
+
+
+def reset_executor(executor):
+    """Descarta um pool quebrado (ex.: processo morto por falta de memória); o próximo job cria outro."""
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def find_split_points(pcm, chunk_count, sample_rate=SAMPLE_RATE):
+    """Escolhe os pontos de corte (em amostras) nos trechos mais silenciosos perto das divisões ideais."""
+    frame_length = int(sample_rate * vad.FRAME_MS / 1000)
+    energies = vad.frame_energies_db(pcm, sample_rate)
+    smoothed = np.convolve(energies, np.ones(SMOOTHING_FRAMES) / SMOOTHING_FRAMES, mode='same')
+    search = int(BOUNDARY_SEARCH_SECONDS * 1000 / vad.FRAME_MS)
+
+    points = []
+    for index in range(1, chunk_count):
+        ideal = len(energies) * index // chunk_count
+        low = max(ideal - search, 0)
+        high = min(ideal + search, len(energies))
+        quietest = low + int(np.argmin(smoothed[low:high]))
+        points.append(quietest * frame_length)
+    return points
+
+
+def plan_chunks(pcm, workers, sample_rate=SAMPLE_RATE):
+    """Divide o PCM em trechos (início, fim) cortados em silêncios, em número suficiente para ocupar os workers."""
+    duration = len(pcm) / sample_rate
+    chunk_seconds = min(max(duration / workers, MIN_CHUNK_SECONDS), MAX_CHUNK_SECONDS)
+    chunk_count = max(1, int(round(duration / chunk_seconds)))
+    boundaries = [0] + find_split_points(pcm, chunk_count, sample_rate) + [len(pcm)]
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+
+
+def _transcribe_chunk(pcm, config, executable, work_dir):
+    """Executado em um processo do pool: transcreve um trecho e devolve os segmentos (início, fim, texto)."""
+    output_dir = tempfile.mkdtemp(prefix='chunk_', dir=work_dir)
+    try:
+        whisper_backend.transcribe_pcm(pcm, 'chunk', output_dir, config, executable, output_dir)
+        srt_path = os.path.join(output_dir, 'chunk.srt')
+        if not os.path.exists(srt_path):
+            return []
+        subs = pysrt.open(srt_path, encoding='utf-8')
+        return [(sub.start.ordinal / 1000, sub.end.ordinal / 1000, sub.text) for sub in subs]
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+def transcribe_in_chunks(pcm, srt_path, config, executable, offset_seconds=0.0, work_dir=None, on_segment=None):
+    """Transcreve um áudio longo em paralelo e junta os SRTs com os tempos corrigidos e numeração contínua.
+
+    on_segment recebe os segmentos de cada trecho, em ordem, assim que o trecho termina.
+    """
+    chunks = plan_chunks(pcm, chunk_worker_count())
+    logging.info(f"Transcrevendo {len(pcm) / SAMPLE_RATE:.0f}s de áudio em {len(chunks)} trechos paralelos")
+
+    executor = get_executor()
+    segments = []
+    try:
+        # Cada trecho é enviado ao processo como PCM em memória, sem arquivos intermediários
+        futures = [(start, executor.submit(_transcribe_chunk, pcm[start:end], config, executable, work_dir))
+                   for start, end in chunks]
+
+        for start, future in futures:
+            chunk_offset = offset_seconds + start / SAMPLE_RATE
+            for seg_start, seg_end, text in future.result():
+                segments.append((seg_start + chunk_offset, seg_end + chunk_offset, text))
+                if on_segment:
+                    on_segment(*segments[-1])
+    except BrokenProcessPool:
+        # Um pool quebrado recusa todos os envios seguintes; este job falha, mas os próximos recebem um pool novo
+        logging.error("Pool de transcrição em trechos quebrado; será recriado no próximo job")
+        reset_executor(executor)
+        raise
+
+    whisper_backend.write_srt(segments, srt_path)
+    return srt_path
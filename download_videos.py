@@ -3,15 +3,24 @@ import subprocess
 import logging
 import sqlite3
 import json
+import math
 import unicodedata
 import re
+import time
+import threading
 import urllib
+import uuid
+import wave
+import tempfile
 from pathvalidate import sanitize_filename
 from logging.handlers import RotatingFileHandler
 from concurrent.futures import ThreadPoolExecutor
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, Response
 from flask import render_template_string
-from lock import acquire_lock, release_lock
+from lock import acquire_lock, release_lock, PRIORITY_LOW
+import metrics
+import media_probe
+from job_store import JobStore
 
 
 app = Flask(__name__)
@@ -47,35 +56,203 @@ logger.addHandler(ch)
 MAX_WORKERS = 3
 executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
 
+# Tamanho máximo (MB) de cada arquivo entregue; vídeos maiores são divididos
+MAX_SEGMENT_BYTES = int(os.environ.get('MAX_SEGMENT_MB', 31)) * 1024 * 1024
+
+# Fração do tamanho máximo usada no planejamento (folga para o contêiner e variações do encoder)
+SEGMENT_SIZE_MARGIN = 0.95
+
+# Encoder de vídeo: "auto" usa NVENC quando a GPU está disponível, "nvenc" sempre, "cpu" sempre libx264
+VIDEO_ENCODER = os.environ.get('VIDEO_ENCODER', 'auto').lower()
+
+# Preset e threads do libx264 (0 = o ffmpeg decide pelo número de núcleos)
+X264_PRESET = os.environ.get('X264_PRESET', 'veryfast')
+X264_THREADS = int(os.environ.get('X264_THREADS', 0))
+
+# Codecs que podem ser copiados para o MP4 de saída sem re-encode
+COMPATIBLE_VIDEO_CODECS = ['h264']
+COMPATIBLE_AUDIO_CODECS = ['aac', 'mp3']
+
+# Resultado da detecção do NVENC (None até a primeira verificação)
+_nvenc_available = None
+
+# Segmentos re-encodados ao mesmo tempo, cada um buscando o seu início na entrada (1 = uma única passada
+# com o segment muxer); sessões NVENC simultâneas são limitadas pela GPU
+SPLIT_PARALLELISM = int(os.environ.get('SPLIT_PARALLELISM', 1))
+
+# Máximo de tarefas aguardando um worker; acima disso /download responde 503
+MAX_PENDING_DOWNLOADS = int(os.environ.get('MAX_PENDING_DOWNLOADS', 100))
+
+# Ocupação do pool de downloads (tarefas em execução e aguardando)
+_pool_lock = threading.Lock()
+_active_downloads = 0
+_pending_downloads = 0
+
 DATABASE = 'tasks.db'
 
+# Integração com o serviço de transcrição (transcribe_configurable_all.py): os jobs de
+# /download_and_transcribe são gravados na mesma fila persistente (JOB_DATABASE) que ele consome
+TRANSCRIPTION_UPLOAD_FOLDER = os.environ.get('TRANSCRIPTION_UPLOAD_FOLDER', 'uploads')
+TRANSCRIPTION_OUTPUT_FOLDER = os.environ.get('TRANSCRIPTION_OUTPUT_FOLDER', 'transcriptions')
+TRANSCRIPTION_SERVICE_URL = os.environ.get('TRANSCRIPTION_SERVICE_URL', 'http://127.0.0.1:5502')
+TRANSCRIPTION_SAMPLE_RATE = 16000
+transcription_queue = JobStore()
+
+# Métricas expostas em /metrics (formato Prometheus)
+DOWNLOAD_TASKS = metrics.counter('download_tasks_total', 'Tarefas de download concluídas, por resultado', ('outcome',))
+DOWNLOAD_SECONDS = metrics.histogram('download_seconds', 'Tempo de download do vídeo pelo yt-dlp')
+FFMPEG_SECONDS = metrics.histogram('ffmpeg_seconds', 'Tempo das etapas do ffmpeg', ('stage',))
+metrics.gauge('download_active_workers', 'Tarefas de download em execução').set_function(
+    lambda: _active_downloads)
+metrics.gauge('download_queued_tasks', 'Tarefas de download aguardando um worker').set_function(
+    lambda: _pending_downloads)
+FFMPEG_BYTES = metrics.counter('ffmpeg_bytes_processed_total', 'Bytes de entrada processados pelo ffmpeg', ('stage',))
+
+# Coluna com o horário de entrada em cada status
+STATUS_TIMESTAMP_COLUMNS = {
+    'QUEUED': 'queued_at',
+    'STARTED': 'started_at',
+    'COMPLETED': 'completed_at',
+    'FAILED': 'failed_at',
+}
+
+TASK_COLUMNS = ['id', 'id_request', 'id_user', 'status', 'progress', 'error_message', 'log_filename', 'result',
+                'created_at', 'updated_at'] + list(STATUS_TIMESTAMP_COLUMNS.values())
+
+# Colunas acrescentadas depois da criação da tabela, adicionadas em bancos existentes
+ADDED_TASK_COLUMNS = {'progress': 'TEXT', 'result': 'TEXT'}
+
+# Limites de paginação da rota /tasks
+DEFAULT_TASKS_PAGE_SIZE = 50
+MAX_TASKS_PAGE_SIZE = 500
+
+_db_local = threading.local()
+
+def get_db():
+    """Conexão SQLite reaproveitada pela thread atual (WAL, autocommit)"""
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DATABASE, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        _db_local.conn = conn
+    return conn
+
 def init_db():
     """Função para inicializar o banco de dados SQLite"""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS tasks (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            id_request TEXT,
-            id_user TEXT,
-            status TEXT,
-            error_message TEXT,
-            log_filename TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-def update_task_status(id_request, id_user, status, error_message=None, log_filename=None):
-    """Atualiza o status de uma tarefa no banco de dados"""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO tasks (id_request, id_user, status, error_message, log_filename)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (id_request, id_user, status, error_message, log_filename))
-    conn.commit()
-    conn.close()
+    conn = get_db()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        columns = [row['name'] for row in conn.execute('PRAGMA table_info(tasks)')]
+        if columns and 'created_at' not in columns:
+            # Tabela antiga (uma linha por mudança de status): migra mantendo só o último status de cada tarefa
+            conn.execute('ALTER TABLE tasks RENAME TO tasks_legacy')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                id_request TEXT NOT NULL,
+                id_user TEXT NOT NULL,
+                status TEXT NOT NULL,
+                progress TEXT,
+                error_message TEXT,
+                log_filename TEXT,
+                result TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                queued_at REAL,
+                started_at REAL,
+                completed_at REAL,
+                failed_at REAL,
+                UNIQUE (id_user, id_request)
+            )
+        ''')
+        if columns and 'created_at' not in columns:
+            now = time.time()
+            conn.execute('''
+                INSERT OR IGNORE INTO tasks (id_request, id_user, status, error_message, log_filename, created_at, updated_at)
+                SELECT COALESCE(id_request, ''), COALESCE(id_user, ''), COALESCE(status, ''), error_message, log_filename, ?, ?
+                FROM tasks_legacy
+                WHERE id IN (SELECT MAX(id) FROM tasks_legacy GROUP BY id_user, id_request)
+                ORDER BY id
+            ''', (now, now))
+            conn.execute('DROP TABLE tasks_legacy')
+            logger.info("Tabela de tarefas migrada para uma linha por (id_user, id_request)")
+        existing = [row['name'] for row in conn.execute('PRAGMA table_info(tasks)')]
+        for column, column_type in ADDED_TASK_COLUMNS.items():
+            if column not in existing:
+                conn.execute(f'ALTER TABLE tasks ADD COLUMN {column} {column_type}')
+        # A restrição UNIQUE já indexa (id_user, id_request); os demais índices atendem os filtros de /tasks
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_user_id ON tasks (id_user, id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_request_id ON tasks (id_request, id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_status_id ON tasks (status, id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_tasks_user_status_id ON tasks (id_user, status, id)')
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+def fail_interrupted_tasks():
+    """Marca como FAILED as tarefas que estavam na fila ou em execução quando o serviço parou.
+
+    Sem isso elas ficariam QUEUED/STARTED para sempre e /download responderia 409 a cada novo envio.
+    """
+    now = time.time()
+    interrupted = get_db().execute(
+        "UPDATE tasks SET status = 'FAILED', error_message = ?, failed_at = ?, updated_at = ? "
+        "WHERE status IN ('QUEUED', 'STARTED')",
+        ("Interrupted by a service restart", now, now)).rowcount
+    if interrupted:
+        logger.warning(f"{interrupted} tarefas interrompidas pelo reinício marcadas como FAILED")
+    return interrupted
+
+def update_task_status(id_request, id_user, status, error_message=None, log_filename=None, progress=None, result=None):
+    """Atualiza o status de uma tarefa no banco de dados (uma linha por id_user/id_request)"""
+    now = time.time()
+    timestamp_column = STATUS_TIMESTAMP_COLUMNS.get(status)
+    # O horário de entrada no status só muda quando o status muda (atualizações de progresso o preservam)
+    timestamp_update = (f", {timestamp_column} = CASE WHEN tasks.status = excluded.status "
+                        f"THEN tasks.{timestamp_column} ELSE excluded.updated_at END") if timestamp_column else ""
+    timestamp_insert = f", {timestamp_column}" if timestamp_column else ""
+    get_db().execute(f'''
+        INSERT INTO tasks (id_request, id_user, status, progress, error_message, log_filename, result,
+                           created_at, updated_at{timestamp_insert})
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?{', ?' if timestamp_column else ''})
+        ON CONFLICT (id_user, id_request) DO UPDATE SET
+            status = excluded.status,
+            progress = excluded.progress,
+            error_message = excluded.error_message,
+            log_filename = COALESCE(excluded.log_filename, tasks.log_filename),
+            result = excluded.result,
+            updated_at = excluded.updated_at{timestamp_update}
+    ''', (id_request, id_user, status, progress, error_message, log_filename,
+          json.dumps(result) if result is not None else None, now, now) + ((now,) if timestamp_column else ()))
+
+def task_to_dict(row):
+    task = dict(row)
+    task['result'] = json.loads(task['result']) if task['result'] else None
+    return task
+
+def get_task(id_user, id_request):
+    """Busca uma tarefa pelo par (id_user, id_request)"""
+    row = get_db().execute(f'SELECT {", ".join(TASK_COLUMNS)} FROM tasks WHERE id_user = ? AND id_request = ?',
+                           (id_user, id_request)).fetchone()
+    return task_to_dict(row) if row else None
+
+def list_tasks(id_user=None, id_request=None, status=None, before_id=None, limit=DEFAULT_TASKS_PAGE_SIZE):
+    """Lista tarefas da mais recente para a mais antiga, com paginação por cursor (before_id)"""
+    conditions, params = [], []
+    for column, value in (('id_user', id_user), ('id_request', id_request), ('status', status)):
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    if before_id is not None:
+        conditions.append("id < ?")
+        params.append(before_id)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    rows = get_db().execute(f'SELECT {", ".join(TASK_COLUMNS)} FROM tasks {where} ORDER BY id DESC LIMIT ?',
+                            params + [limit]).fetchall()
+    return [task_to_dict(row) for row in rows]
 
 def configure_individual_logging(id_request, id_user):
     """Configura o logging individual para cada tarefa"""
@@ -113,16 +290,7 @@ def normalize_filename(filename):
 def detect_and_rename_file(file_path, logger):
     """Detecta o formato do vídeo usando ffprobe e renomeia o arquivo se necessário"""
     try:
-        ffprobe_command = [
-            ffprobe_path,
-            '-v', 'error',
-            '-select_streams', 'v:0',
-            '-show_entries', 'format=format_name',
-            '-of', 'default=noprint_wrappers=1:nokey=1',
-            file_path
-        ]
-        result = subprocess.run(ffprobe_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        format_detected = result.stdout.strip().decode('utf-8')
+        format_detected = media_probe.probe(file_path, ffprobe_path).format_name
 
         format_extension_map = {
             'mov,mp4,m4a,3gp,3g2,mj2': '.mp4',
@@ -134,7 +302,7 @@ def detect_and_rename_file(file_path, logger):
 
         file_extension = next((format_extension_map[fmt] for fmt in format_detected.split(',') if fmt in format_extension_map), '.mp4')
         new_file_path = file_path + file_extension
-        os.rename(file_path, new_file_path)
+        media_probe.rename(file_path, new_file_path)
         logger.info(f"Arquivo renomeado para incluir extensão: {file_extension}")
         return new_file_path
 
@@ -146,48 +314,16 @@ def detect_and_rename_file(file_path, logger):
         return new_file_path
 
 def get_video_info(video_path, logger):
-    """Obtém informações do vídeo utilizando ffprobe"""
+    """Obtém informações do vídeo a partir dos metadados do ffprobe (lidos uma vez por arquivo)"""
     try:
-        command = [
-            ffprobe_path,
-            "-v", "error",
-            "-select_streams", "v:0",
-            "-show_entries", "stream=width,height,bit_rate,r_frame_rate,codec_name",
-            "-show_entries", "format=duration,format_name",
-            "-of", "json",
-            video_path
-        ]
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-        video_data = json.loads(result.stdout)
-        video_info = video_data.get("streams", [{}])[0]
-        format_info = video_data.get("format", {})
-
-        width = video_info.get("width", 0)
-        height = video_info.get("height", 0)
-        bit_rate = int(video_info.get("bit_rate", 0))
-        duration = float(format_info.get("duration", 0))
-        r_frame_rate = video_info.get("r_frame_rate", "30/1")
-        codec_name = video_info.get("codec_name", "unknown")
-        format_name = format_info.get("format_name", "unknown")
-
-        file_size = os.path.getsize(video_path)
-        if bit_rate == 0 and duration > 0:
-            bit_rate = int((file_size * 8) / duration)
-            logger.warning(f"Bitrate do vídeo não encontrado. Bitrate estimado: {bit_rate} bps")
+        info = media_probe.probe(video_path, ffprobe_path)
 
-        command_audio = [
-            ffprobe_path,
-            "-v", "error",
-            "-select_streams", "a:0",
-            "-show_entries", "stream=bit_rate,codec_name",
-            "-of", "json",
-            video_path
-        ]
-        result_audio = subprocess.run(command_audio, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-        audio_info = json.loads(result_audio.stdout).get("streams", [{}])[0]
-        audio_bit_rate = int(audio_info.get("bit_rate", 0))
-        audio_codec_name = audio_info.get("codec_name", "unknown")
+        bit_rate = info.video_bit_rate
+        if bit_rate == 0 and info.duration > 0:
+            bit_rate = info.bit_rate
+            logger.warning(f"Bitrate do vídeo não encontrado. Bitrate estimado: {bit_rate} bps")
 
+        audio_bit_rate = info.audio_bit_rate
         if audio_bit_rate == 0:
             audio_bit_rate = 128000  # Bitrate padrão de áudio estimado
 
@@ -196,23 +332,23 @@ def get_video_info(video_path, logger):
         unsupported_audio_codecs = ['opus', 'vorbis']
 
         needs_transcoding = (
-            format_name in unsupported_video_formats or 
-            codec_name in unsupported_video_codecs or 
-            audio_info["codec_name"] in unsupported_audio_codecs
+            info.format_name in unsupported_video_formats or 
+            info.video_codec in unsupported_video_codecs or 
+            info.audio_codec in unsupported_audio_codecs
         )
 
         return {
-            "width": width,
-            "height": height,
+            "width": info.width,
+            "height": info.height,
             "bit_rate": bit_rate,
-            "duration": duration,
-            "r_frame_rate": r_frame_rate,
-            "codec_name": codec_name,
-            "format_name": format_name,
+            "duration": info.duration,
+            "r_frame_rate": info.r_frame_rate,
+            "codec_name": info.video_codec,
+            "format_name": info.format_name,
             "needs_transcoding": needs_transcoding
         }, {
             "bit_rate": audio_bit_rate,
-            "codec_name": audio_codec_name
+            "codec_name": info.audio_codec
         }
 
     except Exception as e:
@@ -221,103 +357,226 @@ def get_video_info(video_path, logger):
 
 # Resto do código permanece o mesmo...
 
-def transcode_video(video_path, output_dir, video_info, audio_info, logger, codec="h264_nvenc", target_resolution=720, use_nvenc=True, audio_codec="aac", hw_accel="cuda"):
-    """Transcodifica o vídeo utilizando NVENC ou outro codec conforme necessário"""
-    try:
-        acquire_lock()  # Adquirir o lock antes de usar a GPU
+def nvenc_available():
+    """Verifica uma única vez se o ffmpeg consegue encodar com h264_nvenc nesta máquina"""
+    global _nvenc_available
+    if _nvenc_available is None:
+        command = [
+            ffmpeg_path, "-v", "error",
+            "-f", "lavfi", "-i", "color=size=256x256:duration=0.1",
+            "-c:v", "h264_nvenc",
+            "-f", "null", "-"
+        ]
+        try:
+            _nvenc_available = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=60).returncode == 0
+        except (OSError, subprocess.TimeoutExpired):
+            _nvenc_available = False
+        logger.info(f"NVENC {'disponível' if _nvenc_available else 'indisponível'}; encoder de vídeo: {VIDEO_ENCODER}")
+    return _nvenc_available
+
+
+def use_hardware_encoder():
+    """Decide entre NVENC e libx264 conforme VIDEO_ENCODER e a detecção de hardware"""
+    if VIDEO_ENCODER == 'nvenc':
+        return True
+    if VIDEO_ENCODER == 'cpu':
+        return False
+    return nvenc_available()
+
+
+def video_encoder_args(codec="h264_nvenc", use_nvenc=True):
+    """Opções do encoder de vídeo; no libx264, com o preset e as threads configurados"""
+    if use_nvenc:
+        return ["-c:v", codec]
+    args = ["-c:v", "libx264", "-preset", X264_PRESET]
+    if X264_THREADS:
+        args += ["-threads", str(X264_THREADS)]
+    return args
+
+
+def decide_transcode(video_info, audio_info, target_resolution=720):
+    """Escolhe o caminho mais barato que entrega um MP4 H.264/AAC na resolução alvo.
+
+    "remux" copia os streams (só troca o contêiner), "audio" copia o vídeo e re-encoda o áudio e
+    "full" re-encoda tudo. needs_transcoding também marca contêineres (webm, flv...) que o remux já
+    resolve; por isso a decisão olha os codecs e a resolução.
+    """
+    if video_info["codec_name"] not in COMPATIBLE_VIDEO_CODECS or video_info["height"] > target_resolution:
+        return "full"
+    if audio_info["codec_name"] not in COMPATIBLE_AUDIO_CODECS + ['unknown']:  # 'unknown': sem áudio
+        return "audio"
+    return "remux"
+
+
+def transcode_args(video_info, video_bit_rate, audio_bit_rate, codec="h264_nvenc", target_resolution=720, use_nvenc=True, audio_codec="aac"):
+    """Opções de saída do ffmpeg para o vídeo redimensionado (bitrates em bps)"""
+    width = video_info["width"]
+    height = video_info["height"]
+    frame_rate = media_probe.parse_rate(video_info["r_frame_rate"])
+
+    # Resolução de saída parametrizada
+    target_height = target_resolution if height > target_resolution else height
+    target_width = int((width / height) * target_height)
+    scale_filter = f"scale={target_width}:{target_height}"
+
+    return [
+        *video_encoder_args(codec, use_nvenc),  # Codec de vídeo parametrizado
+        "-b:v", f"{video_bit_rate}",
+        "-vf", scale_filter,
+        "-r", str(frame_rate),
+        "-c:a", audio_codec,  # Codec de áudio parametrizado
+        "-b:a", f"{audio_bit_rate // 1000}k",
+        "-ar", "44100",
+    ]
 
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
 
-        width = video_info["width"]
-        height = video_info["height"]
-        video_bit_rate = int(video_info["bit_rate"])
-        audio_bit_rate = int(audio_info["bit_rate"]) // 1000
-        frame_rate = eval(video_info["r_frame_rate"])
+def plan_encode(duration, video_bit_rate, audio_bit_rate, max_segment_bytes=MAX_SEGMENT_BYTES):
+    """Calcula, antes de encodar, os cortes para que cada arquivo fique abaixo de max_segment_bytes.
 
-        # Resolução de saída parametrizada
-        target_height = target_resolution if height > target_resolution else height
-        target_width = int((width / height) * target_height)
-        scale_filter = f"scale={target_width}:{target_height}"
+    O bitrate de origem é mantido; como o número de segmentos é arredondado para cima, cada
+    segmento já cabe no orçamento nesse bitrate.
+    """
+    budget_bits = max_segment_bytes * 8 * SEGMENT_SIZE_MARGIN
+    total_bit_rate = video_bit_rate + audio_bit_rate
+    num_segments = max(1, math.ceil(duration * total_bit_rate / budget_bits)) if duration > 0 else 1
+    segment_duration = duration / num_segments if duration > 0 else 0
 
-        output_file = os.path.join(output_dir, os.path.splitext(os.path.basename(video_path))[0] + "_resized_transcoded.mp4")
+    return {
+        "video_bit_rate": video_bit_rate,
+        "audio_bit_rate": audio_bit_rate,
+        "num_segments": num_segments,
+        "segment_duration": segment_duration,
+        "estimated_segment_bytes": int(segment_duration * total_bit_rate / 8)
+    }
 
-        # Usando NVENC ou outro codec de vídeo conforme o parâmetro
-        video_codec = codec if use_nvenc else "libx264"
 
-        transcode_command = [
-            ffmpeg_path,
-            "-y",
-            "-hwaccel", hw_accel,  # Aceleração por hardware parametrizada
-            "-i", video_path,
-            "-c:v", video_codec,  # Codec de vídeo parametrizado
-            "-b:v", f"{video_bit_rate}",
-            "-vf", scale_filter,
-            "-r", str(frame_rate),
-            "-c:a", audio_codec,  # Codec de áudio parametrizado
-            "-b:a", f"{audio_bit_rate}k",
-            "-ar", "44100",
-            output_file
-        ]
+def encode_segments(video_path, output_dir, video_info, plan, logger, mode="full", codec="h264_nvenc", target_resolution=720, use_nvenc=True, audio_codec="aac", hw_accel="cuda"):
+    """Gera os arquivos finais seguindo o plano de plan_encode.
 
+    mode vem de decide_transcode: "remux" copia os streams, "audio" re-encoda só o áudio e
+    "full" redimensiona e re-encoda tudo. Por padrão tudo sai de uma única passada; com
+    SPLIT_PARALLELISM > 1, os segmentos do modo "full" são re-encodados em paralelo.
+    """
+    uses_gpu = mode == "full" and use_nvenc
+    try:
+        if uses_gpu:
+            acquire_lock(priority=PRIORITY_LOW)  # Adquirir o lock antes de usar a GPU (transcodificações cedem a vez às transcrições)
+
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        if plan["num_segments"] > 1:
+            # Segmentos de uma execução anterior no mesmo diretório não podem entrar no resultado
+            for name in os.listdir(output_dir):
+                if re.fullmatch(r"segment_\d+\.mp4|segments\.txt", name):
+                    os.remove(os.path.join(output_dir, name))
+            if mode == "full" and SPLIT_PARALLELISM > 1:
+                stage_start = time.time()
+                output_files = encode_segments_parallel(video_path, output_dir, video_info, plan, codec, target_resolution, use_nvenc, audio_codec, hw_accel)
+                FFMPEG_SECONDS.observe(time.time() - stage_start, stage='transcode')
+                FFMPEG_BYTES.inc(os.path.getsize(video_path), stage='transcode')
+                logger.info(f"Encoding ({mode}) completed in {plan['num_segments']} parallel segments. Output files: {output_files}")
+                return output_files
+
+        video_bit_rate = plan["video_bit_rate"]
+        transcode_command = [ffmpeg_path, "-y"]
+        if uses_gpu:
+            transcode_command += ["-hwaccel", hw_accel]  # Aceleração por hardware parametrizada
+        transcode_command += ["-i", video_path, "-map", "0:v:0", "-map", "0:a:0?"]
+        if mode == "full":
+            transcode_command += [
+                *transcode_args(video_info, video_bit_rate, plan["audio_bit_rate"], codec, target_resolution, use_nvenc, audio_codec),
+                # VBV: picos de bitrate não fazem um segmento passar do tamanho planejado
+                "-maxrate", f"{video_bit_rate}",
+                "-bufsize", f"{video_bit_rate}",
+            ]
+        elif mode == "audio":
+            transcode_command += ["-c:v", "copy", "-c:a", audio_codec, "-b:a", f"{plan['audio_bit_rate'] // 1000}k", "-ar", "44100"]
+        else:
+            transcode_command += ["-c", "copy"]
+
+        if plan["num_segments"] == 1:
+            output_file = os.path.join(output_dir, os.path.splitext(os.path.basename(video_path))[0] + "_resized_transcoded.mp4")
+            transcode_command.append(output_file)
+        else:
+            segment_duration = f"{plan['segment_duration']:.3f}"
+            output_pattern = os.path.join(output_dir, "segment_%d.mp4")
+            segment_list = os.path.join(output_dir, "segments.txt")
+            if mode == "full":
+                # Keyframes forçados nos cortes para que o segment muxer divida exatamente nos tempos planejados
+                transcode_command += ["-force_key_frames", f"expr:gte(t,n_forced*{segment_duration})"]
+            transcode_command += [
+                "-f", "segment",
+                "-segment_time", segment_duration,
+                "-segment_start_number", "1",
+                "-reset_timestamps", "1",
+                "-segment_list", segment_list,
+                "-segment_list_type", "flat",
+                output_pattern
+            ]
+
+        stage = 'transcode' if mode == "full" else mode
+        stage_start = time.time()
         subprocess.run(transcode_command, check=True)
-        logger.info(f"Transcoding completed successfully using {video_codec}. Output file: {output_file}")
-        return output_file
+        FFMPEG_SECONDS.observe(time.time() - stage_start, stage=stage)
+        FFMPEG_BYTES.inc(os.path.getsize(video_path), stage=stage)
+
+        if plan["num_segments"] == 1:
+            output_files = [output_file]
+        else:
+            # A lista do segment muxer traz exatamente os arquivos gerados nesta passada
+            with open(segment_list) as f:
+                output_files = [os.path.join(output_dir, line.strip()) for line in f if line.strip()]
+            os.remove(segment_list)
+        logger.info(f"Encoding ({mode}) completed in a single pass ({plan['num_segments']} planned segments). Output files: {output_files}")
+        return output_files
 
     except subprocess.CalledProcessError as e:
-        logger.error(f"Error during transcoding: {e.stderr}")
+        logger.error(f"Error during transcoding ({mode}): {e.stderr}")
         raise
     finally:
-        release_lock()  # Libera o lock após o uso da GPU
+        if uses_gpu:
+            release_lock()  # Libera o lock após o uso da GPU
+
+
+def encode_segments_parallel(video_path, output_dir, video_info, plan, codec, target_resolution, use_nvenc, audio_codec, hw_accel):
+    """Re-encoda os segmentos planejados em paralelo; com -ss antes de -i cada ffmpeg decodifica só o próprio trecho"""
+    segment_duration = plan["segment_duration"]
+    video_bit_rate = plan["video_bit_rate"]
+
+    def encode_segment(i):
+        output_segment = os.path.join(output_dir, f"segment_{i+1}.mp4")
+        command = [ffmpeg_path, "-y"]
+        if use_nvenc:
+            command += ["-hwaccel", hw_accel]  # Aceleração por hardware parametrizada
+        command += [
+            "-ss", f"{i * segment_duration:.3f}",
+            "-i", video_path,
+            "-t", f"{segment_duration:.3f}",
+            "-map", "0:v:0", "-map", "0:a:0?",
+            *transcode_args(video_info, video_bit_rate, plan["audio_bit_rate"], codec, target_resolution, use_nvenc, audio_codec),
+            # VBV: picos de bitrate não fazem um segmento passar do tamanho planejado
+            "-maxrate", f"{video_bit_rate}",
+            "-bufsize", f"{video_bit_rate}",
+            output_segment
+        ]
+        subprocess.run(command, check=True)
+        return output_segment
 
+    with ThreadPoolExecutor(max_workers=min(SPLIT_PARALLELISM, plan["num_segments"])) as pool:
+        return list(pool.map(encode_segment, range(plan["num_segments"])))
 
-from lock import acquire_lock, release_lock
 
-def split_video(video_path, segment_duration, output_dir, logger, codec="h264_nvenc", use_nvenc=True, audio_codec="aac", hw_accel="cuda"):
-    """Divide o vídeo em segmentos menores utilizando NVENC ou outro codec conforme necessário"""
-    try:
-        acquire_lock()  # Adquirir o lock antes de usar a GPU
-
-        video_info = get_video_info(video_path, logger)[0]
-        duration = float(video_info['duration'])
-        frame_rate = eval(video_info["r_frame_rate"])
-        video_bit_rate = int(video_info["bit_rate"])
-
-        num_segments = int(duration // segment_duration)
-        segment_files = []
-
-        for i in range(num_segments):
-            start_time = i * segment_duration
-            output_segment = os.path.join(output_dir, f"segment_{i+1}.mp4")
-
-            # Usando NVENC ou outro codec de vídeo conforme o parâmetro
-            video_codec = codec if use_nvenc else "libx264"
-
-            split_command = [
-                ffmpeg_path,
-                "-y",
-                "-hwaccel", hw_accel,  # Aceleração por hardware parametrizada
-                "-i", video_path,
-                "-ss", str(start_time),
-                "-t", str(segment_duration),
-                "-c:v", video_codec,  # Codec de vídeo parametrizado
-                "-b:v", f"{video_bit_rate}",
-                "-r", str(frame_rate),
-                "-c:a", audio_codec,  # Codec de áudio parametrizado
-                "-b:a", "128k",
-                output_segment
-            ]
-            subprocess.run(split_command, check=True)
-            segment_files.append(output_segment)
+def adjust_url(url, logger):
+    """Completa o esquema ausente e decodifica a URL recebida"""
+    parsed_url = urllib.parse.urlparse(url)
+    if not parsed_url.scheme:
+        url = 'https://' + url
+        logger.warning(f"URL missing scheme, adjusted to: {url}")
 
-        logger.info(f"Splitting completed using {video_codec}. Segments: {segment_files}")
-        return segment_files
-
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Error during splitting: {e.stderr}")
-        raise
-    finally:
-        release_lock()  # Libera o lock após o uso da GPU
+    url = urllib.parse.unquote(url)
+    logger.info(f"Final adjusted URL: {url}")
+    return url
 
 
 def worker_task(url, id_request, id_user):
@@ -332,18 +591,12 @@ def worker_task(url, id_request, id_user):
     video_file_path = os.path.join(base_dir, 'video')
 
     try:
-        parsed_url = urllib.parse.urlparse(url)
-        if not parsed_url.scheme:
-            url = 'https://' + url
-            task_logger.warning(f"URL missing scheme, adjusted to: {url}")
-
-        url = urllib.parse.unquote(url)
-        task_logger.info(f"Final adjusted URL: {url}")
-
+        url = adjust_url(url, task_logger)
     except Exception as e:
         error_message = f"Failed to adjust URL: {url} with error: {str(e)}"
         task_logger.error(error_message)
         update_task_status(id_request, id_user, 'FAILED', error_message)
+        DOWNLOAD_TASKS.inc(outcome='failed')
         return {"message": "Failed to process video.", "error": error_message}
 
     yt_dlp_command = [
@@ -354,13 +607,16 @@ def worker_task(url, id_request, id_user):
     ]
 
     try:
-        update_task_status(id_request, id_user, 'STARTED')
+        update_task_status(id_request, id_user, 'STARTED', log_filename=log_filename, progress='downloading')
+        download_start = time.time()
         result = subprocess.run(yt_dlp_command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        DOWNLOAD_SECONDS.observe(time.time() - download_start)
         task_logger.info(f"Video download completed for request {id_request} by user {id_user}")
     except subprocess.CalledProcessError as e:
         error_message = f"Failed to download video from URL: {url} with error: {e.stderr}"
         task_logger.error(error_message)
         update_task_status(id_request, id_user, 'FAILED', error_message)
+        DOWNLOAD_TASKS.inc(outcome='failed')
         return {"message": "Failed to process video.", "error": str(e)}
 
     download_extension = None
@@ -376,39 +632,228 @@ def worker_task(url, id_request, id_user):
         video_file_path = detect_and_rename_file(video_file_path, task_logger)
 
     normalized_video_path = os.path.join(os.path.dirname(video_file_path), normalize_filename(os.path.basename(video_file_path)))
-    os.rename(video_file_path, normalized_video_path)
+    media_probe.rename(video_file_path, normalized_video_path)
 
     video_info, audio_info = get_video_info(normalized_video_path, task_logger)
-    final_video_path = transcode_video(normalized_video_path, base_dir, video_info, audio_info, task_logger)
-
-    if os.path.getsize(final_video_path) > 31 * 1024 * 1024:
-        segment_duration = int(video_info["duration"] // (os.path.getsize(final_video_path) / (31 * 1024 * 1024)))
-        final_videos = split_video(final_video_path, segment_duration, base_dir, task_logger)
-    else:
-        final_videos = [final_video_path]
+    plan = plan_encode(video_info["duration"], video_info["bit_rate"], audio_info["bit_rate"])
+    task_logger.info(f"Encoding plan: {plan}")
+    mode = decide_transcode(video_info, audio_info)
+    use_nvenc = mode == "full" and use_hardware_encoder()
+    task_logger.info(f"Transcode decision: {mode} (needs_transcoding={video_info['needs_transcoding']}, encoder={'h264_nvenc' if use_nvenc else 'libx264'})")
+    update_task_status(id_request, id_user, 'STARTED', progress='transcoding')
+    final_videos = encode_segments(normalized_video_path, base_dir, video_info, plan, task_logger, mode=mode, use_nvenc=use_nvenc)
+
+    oversized = [video for video in final_videos if os.path.getsize(video) > MAX_SEGMENT_BYTES]
+    if oversized and mode != "full":
+        # Sem re-encode os cortes caem nos keyframes de origem e o tamanho não é garantido
+        task_logger.warning(f"Segments above {MAX_SEGMENT_BYTES} bytes after {mode}: {oversized}. Re-encoding.")
+        for video in final_videos:
+            os.remove(video)
+        use_nvenc = use_hardware_encoder()
+        final_videos = encode_segments(normalized_video_path, base_dir, video_info, plan, task_logger, mode="full", use_nvenc=use_nvenc)
+        oversized = [video for video in final_videos if os.path.getsize(video) > MAX_SEGMENT_BYTES]
+    if oversized:
+        task_logger.warning(f"Segments above {MAX_SEGMENT_BYTES} bytes: {oversized}")
 
     response_data = {
         "message": "Download, transcode, resize and split successful",
         "number_of_videos": len(final_videos),
         "video_paths": final_videos,
+        "video_sizes": [os.path.getsize(video) for video in final_videos],
         "log_file": log_filename
     }
-    update_task_status(id_request, id_user, 'COMPLETED')
+    update_task_status(id_request, id_user, 'COMPLETED', result=response_data)
+    DOWNLOAD_TASKS.inc(outcome='completed')
     return response_data
 
 
-@app.route('/download', methods=['POST'])
-def download_video():
+def transcription_config(data):
+    """Configuração do job de transcrição, com os mesmos campos e padrões do /upload"""
+    def option(name):
+        value = data.get(name)
+        return str(value) if value is not None else None
+
+    return {
+        'model': option('model') or 'medium',
+        'beam_size': option('beam_size'),
+        'chunk_length': option('chunk_length'),
+        'torch_dtype': option('torch_dtype'),
+        'remove_audio_after_transcription': str(data.get('remove_audio_after_transcription', 'false')).lower() == 'true'
+    }
+
+
+def audio_task(url, id_request, id_user, config):
+    """Baixa só o áudio da URL, decodifica direto para WAV 16 kHz mono e enfileira a transcrição"""
+    task_logger, log_filename = configure_individual_logging(id_request, id_user)
+    task_logger.info(f"Audio-only task started for URL: {url}")
+
+    try:
+        url = adjust_url(url, task_logger)
+    except Exception as e:
+        error_message = f"Failed to adjust URL: {url} with error: {str(e)}"
+        task_logger.error(error_message)
+        update_task_status(id_request, id_user, 'FAILED', error_message)
+        DOWNLOAD_TASKS.inc(outcome='failed')
+        return {"message": "Failed to process audio.", "error": error_message}
+
+    # O WAV vai direto para a pasta de uploads do serviço de transcrição, com o ID do job como nome
+    job_id = uuid.uuid4().hex
+    os.makedirs(TRANSCRIPTION_UPLOAD_FOLDER, exist_ok=True)
+    audio_path = os.path.join(TRANSCRIPTION_UPLOAD_FOLDER, f"{job_id}.wav")
+
+    # O yt-dlp escreve o stream de áudio no stdout e o ffmpeg o decodifica à medida que chega,
+    # sem arquivo intermediário; "best" só é usado quando o site não oferece um stream só de áudio
+    yt_dlp_command = ['yt-dlp', '-f', 'bestaudio/best', '--quiet', '--no-warnings', '-o', '-', url]
+    ffmpeg_command = [
+        ffmpeg_path, "-y", "-v", "error",
+        "-i", "pipe:0",
+        "-vn", "-ac", "1", "-ar", str(TRANSCRIPTION_SAMPLE_RATE),
+        "-c:a", "pcm_s16le",
+        audio_path
+    ]
+
+    update_task_status(id_request, id_user, 'STARTED', log_filename=log_filename, progress='downloading')
+    download_start = time.time()
+    with tempfile.TemporaryFile() as download_errors:
+        download = subprocess.Popen(yt_dlp_command, stdout=subprocess.PIPE, stderr=download_errors)
+        decode = subprocess.run(ffmpeg_command, stdin=download.stdout, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        download.stdout.close()
+        download.wait()
+        download_errors.seek(0)
+        download_stderr = download_errors.read().decode('utf-8', errors='replace')
+
+    if download.returncode != 0 or decode.returncode != 0:
+        error_message = f"Failed to download audio from URL: {url} with error: {download_stderr or decode.stderr}"
+        task_logger.error(error_message)
+        if os.path.exists(audio_path):
+            os.remove(audio_path)
+        update_task_status(id_request, id_user, 'FAILED', error_message)
+        DOWNLOAD_TASKS.inc(outcome='failed')
+        return {"message": "Failed to process audio.", "error": error_message}
+
+    DOWNLOAD_SECONDS.observe(time.time() - download_start)
+    audio_bytes = os.path.getsize(audio_path)
+    FFMPEG_BYTES.inc(audio_bytes, stage='audio_decode')
+    with wave.open(audio_path, 'rb') as wav_file:
+        audio_seconds = wav_file.getnframes() / wav_file.getframerate()
+    task_logger.info(f"Audio decoded to {audio_path}: {audio_seconds:.1f}s, {audio_bytes} bytes")
+
+    # Mesmo formato de job gravado pelo /upload; o serviço de transcrição o encontra na fila persistente
+    request_folder = os.path.join(TRANSCRIPTION_OUTPUT_FOLDER, id_user, id_request)
+    os.makedirs(request_folder, exist_ok=True)
+    task = {
+        'job_id': job_id,
+        'user_id': id_user,
+        'audio_seconds': audio_seconds,
+        'media_path': audio_path,
+        'request_folder': request_folder,
+        'config': config,
+        'requested_config': config,
+        'cache_key': None,
+        'enqueued_at': time.time()
+    }
+    transcription_queue.enqueue(job_id, id_user, id_request, task, dispatched=False)
+    task_logger.info(f"Transcription job {job_id} queued")
+
+    response_data = {
+        "message": "Audio downloaded and queued for transcription",
+        "job_id": job_id,
+        "audio_seconds": round(audio_seconds, 3),
+        "audio_bytes": audio_bytes,
+        "transcription_status_url": f"{TRANSCRIPTION_SERVICE_URL}/jobs/{job_id}",
+        "log_file": log_filename
+    }
+    update_task_status(id_request, id_user, 'COMPLETED', result=response_data)
+    DOWNLOAD_TASKS.inc(outcome='completed')
+    return response_data
+
+
+def run_download_task(url, id_request, id_user, task_function=worker_task, **kwargs):
+    """Executa worker_task em um worker do pool, registrando falhas inesperadas na tabela de tarefas"""
+    global _active_downloads, _pending_downloads
+    with _pool_lock:
+        _pending_downloads -= 1
+        _active_downloads += 1
     try:
-        data = request.get_json()
-        url = data.get('url')
-        id_request = data.get('id_request')
-        id_user = data.get('id_user')
-        result = worker_task(url, id_request, id_user)
-        return jsonify(result)
+        return task_function(url, id_request, id_user, **kwargs)
     except Exception as e:
+        logger.error(f"Erro inesperado na tarefa {id_user}/{id_request}: {e}")
+        update_task_status(id_request, id_user, 'FAILED', f"An error occurred: {str(e)}")
+        DOWNLOAD_TASKS.inc(outcome='error')
+        raise
+    finally:
+        with _pool_lock:
+            _active_downloads -= 1
+
+
+def pool_status():
+    """Ocupação do pool de downloads"""
+    with _pool_lock:
+        return {
+            "max_workers": MAX_WORKERS,
+            "active_workers": _active_downloads,
+            "queued_tasks": _pending_downloads,
+            "max_queued_tasks": MAX_PENDING_DOWNLOADS
+        }
+
+
+def submit_task(data, task_function=worker_task, **kwargs):
+    """Enfileira a tarefa no pool de downloads e monta a resposta (202, ou o resultado com "sync": true)"""
+    global _pending_downloads
+    url = data.get('url')
+    id_request = data.get('id_request')
+    id_user = data.get('id_user')
+    if not url or not id_request or not id_user:
+        return jsonify({"error": "url, id_request and id_user are required"}), 400
+
+    # A verificação e o enfileiramento ficam sob o mesmo lock para não aceitar a mesma tarefa duas vezes
+    with _pool_lock:
+        existing = get_task(id_user, id_request)
+        if existing and existing['status'] in ('QUEUED', 'STARTED'):
+            return jsonify({"error": "Task already in progress", "task": existing}), 409
+        if _pending_downloads >= MAX_PENDING_DOWNLOADS:
+            return jsonify({"error": "Download queue is full, try again later"}), 503
+        update_task_status(id_request, id_user, 'QUEUED')
+        _pending_downloads += 1
+
+    try:
+        future = executor.submit(run_download_task, url, id_request, id_user, task_function, **kwargs)
+    except Exception as e:
+        with _pool_lock:
+            _pending_downloads -= 1
+        update_task_status(id_request, id_user, 'FAILED', f"An error occurred: {str(e)}")
         return jsonify({"error": f"An error occurred: {str(e)}"}), 500
 
+    # Compatibilidade: com "sync": true a resposta aguarda o fim da tarefa, como antes
+    if data.get('sync'):
+        try:
+            return jsonify(future.result())
+        except Exception as e:
+            return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+
+    task = get_task(id_user, id_request)
+    return jsonify({
+        "message": "Task queued",
+        "task_id": task['id'],
+        "status": task['status'],
+        "status_url": f"/tasks/{id_user}/{id_request}"
+    }), 202
+
+@app.route('/download', methods=['POST'])
+def download_video():
+    return submit_task(request.get_json(silent=True) or {})
+
+# Rota que baixa só o áudio e o envia para a fila do serviço de transcrição
+@app.route('/download_and_transcribe', methods=['POST'])
+def download_and_transcribe():
+    data = request.get_json(silent=True) or {}
+    return submit_task(data, audio_task, config=transcription_config(data))
+
+# Rota com as métricas no formato do Prometheus
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 # Rota para visualizar logs individuais
 @app.route('/logs/<log_filename>', methods=['GET'])
 def view_log(log_filename):
@@ -418,21 +863,36 @@ def view_log(log_filename):
     except Exception as e:
         return jsonify({"error": f"Could not find log file: {log_filename}. Error: {str(e)}"}), 404
 
-# Rota para visualizar status dos workers (threads ativas)
+# Rota para visualizar a ocupação do pool de downloads (workers ativos e tarefas aguardando)
 @app.route('/workers_status', methods=['GET'])
 def workers_status():
-    active_threads = threading.active_count()
-    return jsonify({"active_threads": active_threads, "max_workers": MAX_WORKERS})
+    status = pool_status()
+    status["active_threads"] = threading.active_count()
+    return jsonify(status)
 
-# Rota para visualizar as tarefas no banco de dados
+# Rota para consultar as tarefas (filtros id_user, id_request e status; paginação com limit e before_id)
 @app.route('/tasks', methods=['GET'])
 def view_tasks():
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, id_request, id_user, status, error_message FROM tasks ORDER BY id DESC')
-    tasks = cursor.fetchall()
-    conn.close()
-    return render_template('tasks.html', tasks=tasks)
+    try:
+        limit = min(max(int(request.args.get('limit', DEFAULT_TASKS_PAGE_SIZE)), 1), MAX_TASKS_PAGE_SIZE)
+        before_id = request.args.get('before_id')
+        before_id = int(before_id) if before_id else None
+    except ValueError:
+        return jsonify({"error": "Parâmetros 'limit' e 'before_id' devem ser inteiros"}), 400
+
+    tasks = list_tasks(request.args.get('id_user'), request.args.get('id_request'),
+                       request.args.get('status'), before_id, limit)
+    # O cursor da próxima página é o menor id desta; None indica a última página
+    next_before_id = tasks[-1]['id'] if len(tasks) == limit else None
+    return jsonify({"tasks": tasks, "next_before_id": next_before_id})
+
+# Rota para consultar uma tarefa específica
+@app.route('/tasks/<id_user>/<id_request>', methods=['GET'])
+def view_task(id_user, id_request):
+    task = get_task(id_user, id_request)
+    if task is None:
+        return jsonify({"error": "Tarefa não encontrada"}), 404
+    return jsonify(task)
 
 # Rota para servir os arquivos e diretórios da pasta downloads
 @app.route('/downloads/', defaults={'subpath': ''})
@@ -462,5 +922,6 @@ def serve_downloads(subpath):
 # Inicializa o servidor
 if __name__ == '__main__':
     init_db()
+    fail_interrupted_tasks()
     # Expondo o serviço na rede local e no host 0.0.0.0 para permitir o acesso externo
     app.run(debug=True, host='0.0.0.0', port=5008)
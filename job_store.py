@@ -0,0 +1,265 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import logging
+import threading
+
+from jobs import STATUS_QUEUED, STATUS_RUNNING, STATUS_COMPLETED, STATUS_FAILED
+
+# Banco compartilhado pelos processos que produzem e consomem jobs de transcrição
+JOB_DATABASE = os.environ.get('JOB_DATABASE', 'jobs.db')
+
+# Um job cujo worker não renova a concessão nesse intervalo (s) volta para a fila
+JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', 60))
+
+# Intervalo (s) entre renovações de concessão, devoluções de jobs expirados e buscas por jobs novos
+JOB_MAINTENANCE_SECONDS = float(os.environ.get('JOB_MAINTENANCE_SECONDS', 5))
+
+# Jobs concluídos ou falhos são apagados do banco após esse tempo (s); 0 mantém para sempre
+JOB_RETENTION_SECONDS = float(os.environ.get('JOB_RETENTION_SECONDS', 7 * 24 * 3600))
+
+# Intervalo (s) entre limpezas dos jobs antigos
+JOB_PRUNE_INTERVAL_SECONDS = 600
+
+# Tentativas antes de um job que sempre derruba o worker ser marcado como falho
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+
+
+def worker_id():
+    """Identificador deste processo como dono das concessões."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobStore:
+    """Fila de jobs persistente em SQLite (WAL), com concessões (leases) para os workers.
+
+    Cada thread usa a sua própria conexão; as operações da fila são um único comando por chamada.
+    """
+
+    def __init__(self, path=JOB_DATABASE, lease_seconds=JOB_LEASE_SECONDS, max_attempts=JOB_MAX_ATTEMPTS,
+                 owner=None, retention_seconds=JOB_RETENTION_SECONDS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        self.owner = owner or worker_id()
+        self._local = threading.local()
+        self._dispatched = set()  # jobs na fila em memória deste processo
+        self._dispatched_lock = threading.Lock()
+        self._last_event = 0  # último evento de queue_events já lido por undispatched()
+        self._create_schema()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            # Com WAL, NORMAL só perde as últimas transações numa queda de energia, nunca corrompe o banco
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _create_schema(self):
+        conn = self._connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                user_id TEXT,
+                request_id TEXT,
+                status TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                lease_owner TEXT,
+                lease_expires REAL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status_lease ON jobs (status, lease_expires)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status_updated ON jobs (status, updated_at)')
+        # Um evento por entrada de job na fila (inserção ou devolução); cada processo lê só os eventos novos
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS queue_events (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL
+            )
+        ''')
+        # Jobs na fila sem evento (bancos criados antes desta tabela)
+        conn.execute(
+            'INSERT INTO queue_events (job_id) SELECT id FROM jobs WHERE status = ? '
+            'AND id NOT IN (SELECT job_id FROM queue_events)', (STATUS_QUEUED,))
+
+    def enqueue(self, job_id, user_id, request_id, task, dispatched=True):
+        """Grava um job na fila; task deve ser serializável em JSON.
+
+        Use dispatched=False quando o job será consumido por outro processo (ex.: o serviço de download).
+        """
+        now = time.time()
+        if dispatched:
+            self.mark_dispatched(job_id)
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'INSERT INTO jobs (id, user_id, request_id, status, payload, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (job_id, user_id, request_id, STATUS_QUEUED, json.dumps(task), now, now))
+            conn.execute('INSERT INTO queue_events (job_id) VALUES (?)', (job_id,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def record_completed(self, job_id, user_id, request_id, result):
+        """Grava um job que já nasceu concluído (ex.: servido do cache), para consultas após um reinício."""
+        now = time.time()
+        self._connection().execute(
+            'INSERT INTO jobs (id, user_id, request_id, status, payload, result, created_at, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (job_id, user_id, request_id, STATUS_COMPLETED, json.dumps({}), json.dumps(result), now, now))
+
+    def mark_dispatched(self, job_id):
+        """Registra que o job já está na fila em memória deste processo."""
+        with self._dispatched_lock:
+            self._dispatched.add(job_id)
+
+    def claim(self, job_id):
+        """Assume o job de forma atômica; devolve False se outro worker já o assumiu."""
+        now = time.time()
+        cursor = self._connection().execute(
+            'UPDATE jobs SET status = ?, lease_owner = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ? '
+            'WHERE id = ? AND status = ?',
+            (STATUS_RUNNING, self.owner, now + self.lease_seconds, now, job_id, STATUS_QUEUED))
+        with self._dispatched_lock:
+            self._dispatched.discard(job_id)
+        return cursor.rowcount == 1
+
+    def complete(self, job_id, result):
+        self._finish(job_id, STATUS_COMPLETED, result=json.dumps(result))
+
+    def fail(self, job_id, error):
+        self._finish(job_id, STATUS_FAILED, error=error)
+
+    def _finish(self, job_id, status, result=None, error=None):
+        self._connection().execute(
+            'UPDATE jobs SET status = ?, result = ?, error = ?, lease_owner = NULL, lease_expires = NULL, '
+            'updated_at = ? WHERE id = ?',
+            (status, result, error, time.time(), job_id))
+
+    def get(self, job_id):
+        """Estado persistido do job (para consultas após um reinício), ou None."""
+        row = self._connection().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row['id'],
+            "user_id": row['user_id'],
+            "request_id": row['request_id'],
+            "status": row['status'],
+            "result": json.loads(row['result']) if row['result'] else None,
+            "error": row['error'],
+            "attempts": row['attempts'],
+            "created_at": row['created_at'],
+            "finished_at": row['updated_at'] if row['status'] in (STATUS_COMPLETED, STATUS_FAILED) else None
+        }
+
+    def renew_leases(self):
+        """Estende as concessões dos jobs em execução neste processo."""
+        now = time.time()
+        self._connection().execute(
+            'UPDATE jobs SET lease_expires = ? WHERE status = ? AND lease_owner = ?',
+            (now + self.lease_seconds, STATUS_RUNNING, self.owner))
+
+    def requeue_expired(self):
+        """Devolve à fila os jobs de workers que pararam de renovar a concessão (ex.: processo encerrado)."""
+        now = time.time()
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            failed = conn.execute(
+                'UPDATE jobs SET status = ?, error = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ? '
+                'WHERE status = ? AND lease_expires < ? AND attempts >= ?',
+                (STATUS_FAILED, "O worker foi interrompido repetidamente durante este job", now,
+                 STATUS_RUNNING, now, self.max_attempts)).rowcount
+            conn.execute(
+                'INSERT INTO queue_events (job_id) SELECT id FROM jobs WHERE status = ? AND lease_expires < ?',
+                (STATUS_RUNNING, now))
+            requeued = conn.execute(
+                'UPDATE jobs SET status = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ? '
+                'WHERE status = ? AND lease_expires < ?',
+                (STATUS_QUEUED, now, STATUS_RUNNING, now)).rowcount
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if requeued or failed:
+            logging.warning(f"Jobs com concessão expirada: {requeued} devolvidos à fila, {failed} marcados como falhos")
+        return requeued
+
+    def prune_finished(self):
+        """Apaga os jobs concluídos ou falhos há mais de retention_seconds; devolve quantos foram apagados."""
+        if not self.retention_seconds:
+            return 0
+        cutoff = time.time() - self.retention_seconds
+        conn = self._connection()
+        deleted = conn.execute(
+            'DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?',
+            (STATUS_COMPLETED, STATUS_FAILED, cutoff)).rowcount
+        # Eventos de jobs que já saíram da fila; uma nova devolução à fila gera outro evento
+        conn.execute(
+            'DELETE FROM queue_events WHERE job_id NOT IN (SELECT id FROM jobs WHERE status = ?)', (STATUS_QUEUED,))
+        if deleted:
+            logging.info(f"{deleted} jobs antigos removidos da fila persistente")
+        return deleted
+
+    def undispatched(self):
+        """Jobs na fila persistida que ainda não estão na fila em memória deste processo.
+
+        Só os eventos posteriores à última chamada são lidos, então o custo acompanha os jobs
+        novos ou devolvidos, e não o tamanho da fila.
+        """
+        rows = self._connection().execute(
+            'SELECT e.seq, j.id, j.user_id, j.request_id, j.payload FROM queue_events e '
+            'JOIN jobs j ON j.id = e.job_id WHERE e.seq > ? AND j.status = ? ORDER BY e.seq',
+            (self._last_event, STATUS_QUEUED)).fetchall()
+        if not rows:
+            return []
+        self._last_event = rows[-1]['seq']
+        jobs = {}
+        with self._dispatched_lock:
+            for row in rows:
+                if row['id'] not in self._dispatched:
+                    jobs.setdefault(row['id'], (row['id'], row['user_id'], row['request_id'], json.loads(row['payload'])))
+        return list(jobs.values())
+
+    def start_maintenance(self, on_available, interval=JOB_MAINTENANCE_SECONDS):
+        """Inicia a thread que renova concessões, devolve jobs expirados, apaga os antigos e entrega jobs novos a on_available.
+
+        on_available(job_id, user_id, request_id, task) recebe tanto os jobs recuperados após um reinício
+        quanto os inseridos por outros processos.
+        """
+        def loop():
+            last_prune = 0.0
+            while True:
+                try:
+                    self.renew_leases()
+                    self.requeue_expired()
+                    if time.monotonic() - last_prune >= JOB_PRUNE_INTERVAL_SECONDS:
+                        self.prune_finished()
+                        last_prune = time.monotonic()
+                    for job in self.undispatched():
+                        self.mark_dispatched(job[0])
+                        on_available(*job)
+                except Exception as e:
+                    logging.error(f"Erro na manutenção da fila persistente: {e}")
+                time.sleep(interval)
+
+        thread = threading.Thread(target=loop, name="job-store-maintenance", daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,131 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# Estados possíveis de um job de transcrição
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_COMPLETED = 'completed'
+STATUS_FAILED = 'failed'
+
+FINISHED_STATUSES = (STATUS_COMPLETED, STATUS_FAILED)
+
+
+class Job:
+    """Representa um pedido de transcrição e o seu resultado."""
+
+    def __init__(self, job_id, user_id, request_id, config, timer=None):
+        self.id = job_id
+        self.user_id = user_id
+        self.request_id = request_id
+        self.config = config
+        self.status = STATUS_QUEUED
+        self.result = None
+        self.error = None
+        self.segments = []  # Segmentos (início, fim, texto) na ordem em que o modelo os produz
+        self.timer = timer  # timing.StageTimer com o tempo de cada etapa do job
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATUSES
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "user_id": self.user_id,
+            "request_id": self.request_id,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "timing": self.timer.to_dict() if self.timer else None
+        }
+
+
+class JobRegistry:
+    """Registro em memória dos jobs, com espera (long-poll) pela conclusão de cada um."""
+
+    def __init__(self, max_finished=1000):
+        self.max_finished = max_finished
+        self._jobs = OrderedDict()
+        self._condition = threading.Condition()
+
+    def create(self, user_id, request_id, config, timer=None, job_id=None):
+        """Cria um novo job na fila e devolve o objeto criado (job_id é informado ao restaurar um job persistido)."""
+        job = Job(job_id or uuid.uuid4().hex, user_id, request_id, config, timer)
+        with self._condition:
+            self._jobs[job.id] = job
+            self._evict_finished()
+        return job
+
+    def get(self, job_id):
+        with self._condition:
+            return self._jobs.get(job_id)
+
+    def mark_running(self, job_id):
+        with self._condition:
+            job = self._jobs[job_id]
+            job.status = STATUS_RUNNING
+            job.started_at = time.time()
+            self._condition.notify_all()
+
+    def add_segment(self, job_id, start, end, text):
+        """Registra um segmento transcrito e acorda quem acompanha o job em tempo real."""
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.segments.append({"start": round(start, 3), "end": round(end, 3), "text": text.strip()})
+            self._condition.notify_all()
+
+    def wait_for_segments(self, job_id, cursor, timeout=None):
+        """Aguarda segmentos posteriores a cursor (ou o fim do job); devolve (job, novos segmentos)."""
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is not None and len(job.segments) <= cursor and not job.finished:
+                self._condition.wait(timeout)
+            if job is None:
+                return None, []
+            return job, job.segments[cursor:]
+
+    def complete(self, job_id, result):
+        self._finish(job_id, STATUS_COMPLETED, result=result)
+
+    def fail(self, job_id, error):
+        self._finish(job_id, STATUS_FAILED, error=error)
+
+    def wait(self, job_id, timeout=None):
+        """Aguarda até o job terminar ou o timeout expirar; devolve o job (ou None se não existir)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            job = self._jobs.get(job_id)
+            while job is not None and not job.finished:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return job
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._condition:
+            job = self._jobs[job_id]
+            job.status = status
+            job.result = result
+            job.error = error
+            job.finished_at = time.time()
+            # Move o job para o fim, para que os concluídos mais antigos sejam descartados primeiro
+            self._jobs.move_to_end(job_id)
+            self._evict_finished()
+            self._condition.notify_all()
+
+    def _evict_finished(self):
+        """Descarta os jobs concluídos mais antigos quando o limite de retenção é ultrapassado."""
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
@@ -0,0 +1,181 @@
+"""Teste de carga HTTP do endpoint /upload.
+
+Para medir só a camada web (fila, I/O de arquivos, geração do HTML), suba o serviço com o
+stub no lugar do modelo:
+
+    FASTER_WHISPER_PATH=stub_whisper.py TRANSCRIPTION_BACKEND=subprocess STUB_WHISPER_DELAY=0.2 \\
+        python transcribe_configurable_all.py
+
+e dispare a carga:
+
+    python loadtest.py --url http://127.0.0.1:5502 --concurrency 16 --requests 500 --output-json load.json
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import argparse
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+from benchmark import generate_synthetic
+
+LATENCY_PERCENTILES = (50, 95, 99)
+
+
+class LoadTest:
+    """Dispara uploads em paralelo até atingir o número de requisições ou a duração pedida."""
+
+    def __init__(self, base_url, audio_path, concurrency, total_requests=None, duration=None,
+                 async_mode=False, fields=None, timeout=300, allow_cache=False):
+        self.base_url = base_url.rstrip('/')
+        self.audio_name = os.path.basename(audio_path)
+        with open(audio_path, 'rb') as f:
+            self.audio_bytes = f.read()
+        self.allow_cache = allow_cache
+        self.concurrency = concurrency
+        self.total_requests = total_requests
+        self.duration = duration
+        self.async_mode = async_mode
+        self.fields = fields or {}
+        self.timeout = timeout
+        self.results = []
+        self._issued = 0
+        self._lock = threading.Lock()
+        self._deadline = None
+
+    def _next_request(self):
+        """Reserva a próxima requisição; devolve False quando a carga terminou."""
+        with self._lock:
+            if self.total_requests is not None and self._issued >= self.total_requests:
+                return False
+            if self._deadline is not None and time.monotonic() >= self._deadline:
+                return False
+            self._issued += 1
+            return True
+
+    def _upload(self, session, worker):
+        data = {
+            'user_id': f'loadtest-{worker}',
+            'request_id': uuid.uuid4().hex,
+            **self.fields
+        }
+        if self.async_mode:
+            data['async'] = 'true'
+
+        body = self.audio_bytes
+        if not self.allow_cache:
+            # Bytes aleatórios no fim mudam o SHA-256 (e a chave do cache) sem alterar o áudio decodificado
+            body += os.urandom(16)
+        files = {'file': (self.audio_name, body)}
+        response = session.post(f'{self.base_url}/upload', data=data, files=files, timeout=self.timeout)
+        if not self.async_mode or response.status_code != 202:
+            return response.status_code
+
+        # Modo assíncrono: acompanha o job via long-poll até a conclusão
+        job_id = response.json()['job_id']
+        while True:
+            response = session.get(f'{self.base_url}/jobs/{job_id}', params={'wait': 60}, timeout=self.timeout)
+            if response.status_code != 200:
+                return response.status_code
+            status = response.json()['status']
+            if status == 'completed':
+                return 200
+            if status == 'failed':
+                return 500
+
+    def _worker(self, worker):
+        session = requests.Session()
+        while self._next_request():
+            start = time.perf_counter()
+            try:
+                status, error = self._upload(session, worker), None
+            except (requests.RequestException, ValueError, KeyError) as e:
+                status, error = None, type(e).__name__
+            latency = time.perf_counter() - start
+            with self._lock:
+                self.results.append({'latency': latency, 'status': status, 'error': error})
+
+    def run(self):
+        if self.duration is not None:
+            self._deadline = time.monotonic() + self.duration
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for worker in range(self.concurrency):
+                pool.submit(self._worker, worker)
+        return self.report(time.perf_counter() - start)
+
+    def report(self, elapsed):
+        ok = [result for result in self.results if result['status'] == 200]
+        outcomes = Counter(str(result['status'] or result['error']) for result in self.results)
+        report = {
+            'concurrency': self.concurrency,
+            'requests': len(self.results),
+            'successful': len(ok),
+            'errors': len(self.results) - len(ok),
+            'error_rate': round((len(self.results) - len(ok)) / len(self.results), 4) if self.results else None,
+            'outcomes': dict(outcomes),
+            'elapsed_seconds': round(elapsed, 3),
+            'throughput_rps': round(len(ok) / elapsed, 3) if elapsed else None
+        }
+        if ok:
+            latencies = np.array([result['latency'] for result in ok])
+            report['latency_mean'] = round(float(latencies.mean()), 4)
+            for percentile in LATENCY_PERCENTILES:
+                report[f'latency_p{percentile}'] = round(float(np.percentile(latencies, percentile)), 4)
+            report['latency_max'] = round(float(latencies.max()), 4)
+        return report
+
+
+def parse_fields(values):
+    """Converte ['model=small', 'beam_size=1'] em um dicionário de campos do formulário."""
+    fields = {}
+    for value in values or []:
+        key, _, field_value = value.partition('=')
+        fields[key] = field_value
+    return fields
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Teste de carga do endpoint /upload.")
+    parser.add_argument('--url', default='http://127.0.0.1:5502', help="Endereço base do serviço")
+    parser.add_argument('--file', help="Áudio enviado em todas as requisições")
+    parser.add_argument('--synthetic', type=float, default=5.0,
+                        help="Duração (s) do WAV sintético gerado quando --file não é informado")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, help="Total de requisições (padrão: 10 por cliente)")
+    parser.add_argument('--duration', type=float, help="Duração da carga em segundos, em vez de um total fixo")
+    parser.add_argument('--async', dest='async_mode', action='store_true',
+                        help="Usa async=true e acompanha /jobs/<job_id> (transcribe_configurable_all.py)")
+    parser.add_argument('--field', action='append', help="Campo extra do formulário, ex.: --field model=small")
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--allow-cache', action='store_true',
+                        help="Envia sempre os mesmos bytes, deixando o cache de transcrições responder")
+    parser.add_argument('--output-json', help="Grava o relatório em JSON")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+
+    total_requests = args.requests
+    if total_requests is None and args.duration is None:
+        total_requests = 10 * args.concurrency
+
+    with tempfile.TemporaryDirectory(prefix='loadtest_') as work_dir:
+        audio_path = args.file or generate_synthetic(args.synthetic, os.path.join(work_dir, 'loadtest.wav'))
+        report = LoadTest(args.url, audio_path, args.concurrency, total_requests, args.duration,
+                          args.async_mode, parse_fields(args.field), args.timeout, args.allow_cache).run()
+
+    print(json.dumps(report, indent=2))
+    if args.output_json:
+        with open(args.output_json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,184 @@
 import os
 import time
+import threading
+from contextlib import contextmanager
 
-LOCK_FILE = os.path.join(os.getcwd(), "gpu_lock.lock")  # Caminho relativo
+import metrics
+import timing
 
-def acquire_lock():
-    """Função para adquirir o lock criando um arquivo."""
-    while os.path.exists(LOCK_FILE):
-        print("GPU está em uso. Aguardando...")
-        time.sleep(1)  # Espera 1 segundo antes de tentar novamente
-    
-    # Cria o arquivo de lock
-    open(LOCK_FILE, 'w').close()
-    print("Lock adquirido, usando GPU...")
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Diretório com os arquivos de slot e a fila de espera, compartilhado entre download_videos.py e as APIs de transcrição
+LOCK_DIR = os.path.join(os.getcwd(), "gpu_lock")  # Caminho relativo
+
+# Quantidade de processos que podem usar a GPU ao mesmo tempo
+LOCK_SLOTS = int(os.environ.get('GPU_LOCK_SLOTS', 1))
+
+# Prioridades (menor valor = atendido primeiro): transcrições curtas passam à frente de transcodificações longas
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 10
+
+# Intervalos de espera entre tentativas (em segundos)
+MIN_POLL_INTERVAL = 0.005
+MAX_POLL_INTERVAL = 0.05
+
+LOCK_WAIT_SECONDS = metrics.histogram('gpu_lock_wait_seconds', 'Tempo de espera em acquire_lock', ('priority',))
+
+# Tempo mínimo de vida de uma senha antes de ser considerada abandonada
+STALE_TICKET_GRACE = 5.0
+
+
+class LockTimeout(Exception):
+    """Lançada quando o lock não é obtido dentro do tempo limite."""
+
+
+def _try_lock(fd):
+    """Tenta travar o arquivo sem bloquear; o kernel libera a trava se o processo morrer."""
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+class ResourceLock:
+    """Semáforo de N slots entre processos, com fila por prioridade e ordem de chegada."""
+
+    def __init__(self, lock_dir=LOCK_DIR, slots=LOCK_SLOTS):
+        self.lock_dir = lock_dir
+        self.slots = slots
+        self.queue_dir = os.path.join(lock_dir, "queue")
+        os.makedirs(self.queue_dir, exist_ok=True)
+
+    def acquire(self, priority=PRIORITY_NORMAL, timeout=None):
+        """Aguarda a vez na fila e devolve o descritor do slot obtido."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        ticket_name, ticket_fd = self._take_ticket(priority)
+        interval = MIN_POLL_INTERVAL
+        try:
+            while True:
+                # Somente os primeiros N da fila disputam os slots, o que garante a ordem de atendimento
+                if self._queue_position(ticket_name) < self.slots:
+                    slot_fd = self._try_any_slot()
+                    if slot_fd is not None:
+                        return slot_fd
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise LockTimeout(f"Lock não obtido em {timeout} segundos")
+                time.sleep(interval)
+                interval = min(interval * 2, MAX_POLL_INTERVAL)
+        finally:
+            self._drop_ticket(ticket_name, ticket_fd)
+
+    def release(self, slot_fd):
+        _unlock(slot_fd)
+        os.close(slot_fd)
+
+    @contextmanager
+    def hold(self, priority=PRIORITY_NORMAL, timeout=None):
+        slot_fd = self.acquire(priority, timeout)
+        try:
+            yield
+        finally:
+            self.release(slot_fd)
+
+    def _take_ticket(self, priority):
+        ticket_name = f"{priority:03d}-{time.time_ns():020d}-{os.getpid()}-{threading.get_ident()}.ticket"
+        ticket_fd = os.open(os.path.join(self.queue_dir, ticket_name), os.O_CREAT | os.O_RDWR)
+        _try_lock(ticket_fd)
+        return ticket_name, ticket_fd
+
+    def _drop_ticket(self, ticket_name, ticket_fd):
+        _unlock(ticket_fd)
+        os.close(ticket_fd)
+        try:
+            os.remove(os.path.join(self.queue_dir, ticket_name))
+        except OSError:
+            pass
+
+    def _queue_position(self, ticket_name):
+        """Posição da senha na fila, ignorando (e removendo) senhas de processos que morreram."""
+        position = 0
+        for name in sorted(os.listdir(self.queue_dir)):
+            if name >= ticket_name:
+                break
+            if not self._is_stale(name):
+                position += 1
+        return position
+
+    def _is_stale(self, name):
+        path = os.path.join(self.queue_dir, name)
+        try:
+            if time.time() - os.path.getmtime(path) < STALE_TICKET_GRACE:
+                return False
+            fd = os.open(path, os.O_RDWR)
+        except OSError:
+            return True  # Já foi removida
+        try:
+            if not _try_lock(fd):
+                return False
+            _unlock(fd)
+        finally:
+            os.close(fd)
+        # Ninguém mantém a senha travada: o processo que a criou morreu sem removê-la
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return True
+
+    def _try_any_slot(self):
+        for index in range(self.slots):
+            fd = os.open(os.path.join(self.lock_dir, f"slot-{index}.lock"), os.O_CREAT | os.O_RDWR)
+            if _try_lock(fd):
+                return fd
+            os.close(fd)
+        return None
+
+
+_resource_lock = None
+_resource_lock_guard = threading.Lock()
+_held = threading.local()
+
+
+def get_resource_lock():
+    global _resource_lock
+    with _resource_lock_guard:
+        if _resource_lock is None:
+            _resource_lock = ResourceLock()
+        return _resource_lock
+
+
+def acquire_lock(priority=PRIORITY_NORMAL, timeout=None):
+    """Função para adquirir um slot da GPU, aguardando a vez na fila."""
+    started = time.monotonic()
+    slot_fd = get_resource_lock().acquire(priority, timeout)
+    waited = time.monotonic() - started
+    LOCK_WAIT_SECONDS.observe(waited, priority=priority)
+    timing.record('lock_wait', waited)
+    if not hasattr(_held, "slots"):
+        _held.slots = []
+    _held.slots.append(slot_fd)
+    print(f"Lock adquirido após {waited:.3f}s, usando GPU...")
 
 def release_lock():
-    """Função para liberar o lock removendo o arquivo."""
-    if os.path.exists(LOCK_FILE):
-        os.remove(LOCK_FILE)
+    """Função para liberar o último slot adquirido por esta thread."""
+    slots = getattr(_held, "slots", None)
+    if slots:
+        get_resource_lock().release(slots.pop())
         print("Lock liberado, GPU disponível.")
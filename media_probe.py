@@ -0,0 +1,169 @@
+import os
+import json
+import logging
+import subprocess
+import threading
+from collections import OrderedDict
+
+# Quantidade de arquivos cujos metadados ficam em memória
+PROBE_CACHE_SIZE = int(os.environ.get('PROBE_CACHE_SIZE', 256))
+
+_cache = OrderedDict()  # (caminho, mtime, tamanho) -> MediaInfo
+_cache_lock = threading.Lock()
+
+
+def _int(value, default=0):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _float(value, default=0.0):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def parse_rate(rate, default=30.0):
+    """Converte uma taxa do ffprobe ('30000/1001') em número."""
+    try:
+        numerator, _, denominator = str(rate).partition('/')
+        value = float(numerator) / float(denominator or 1)
+        return value if value > 0 else default
+    except (ValueError, ZeroDivisionError):
+        return default
+
+
+class MediaInfo:
+    """Metadados de um arquivo de mídia, lidos de uma única execução do ffprobe."""
+
+    def __init__(self, path, data, size):
+        self.path = path
+        self.size = size
+        self.format = data.get('format', {})
+        self.streams = data.get('streams', [])
+        self.video = next((s for s in self.streams if s.get('codec_type') == 'video'), {})
+        self.audio = next((s for s in self.streams if s.get('codec_type') == 'audio'), {})
+
+    @property
+    def format_name(self):
+        return self.format.get('format_name', 'unknown')
+
+    @property
+    def duration(self):
+        return _float(self.format.get('duration')) or _float(self.video.get('duration')) or _float(self.audio.get('duration'))
+
+    @property
+    def bit_rate(self):
+        """Bitrate total; estimado pelo tamanho quando o contêiner não informa."""
+        bit_rate = _int(self.format.get('bit_rate'))
+        if bit_rate == 0 and self.duration > 0:
+            bit_rate = int(self.size * 8 / self.duration)
+        return bit_rate
+
+    @property
+    def has_video(self):
+        return bool(self.video)
+
+    @property
+    def has_audio(self):
+        return bool(self.audio)
+
+    @property
+    def width(self):
+        return _int(self.video.get('width'))
+
+    @property
+    def height(self):
+        return _int(self.video.get('height'))
+
+    @property
+    def video_codec(self):
+        return self.video.get('codec_name', 'unknown')
+
+    @property
+    def audio_codec(self):
+        return self.audio.get('codec_name', 'unknown')
+
+    @property
+    def video_bit_rate(self):
+        return _int(self.video.get('bit_rate'))
+
+    @property
+    def audio_bit_rate(self):
+        return _int(self.audio.get('bit_rate'))
+
+    @property
+    def r_frame_rate(self):
+        return self.video.get('r_frame_rate', '30/1')
+
+    @property
+    def frame_rate(self):
+        return parse_rate(self.r_frame_rate)
+
+    def to_dict(self):
+        return {
+            "path": self.path,
+            "size": self.size,
+            "format_name": self.format_name,
+            "duration": self.duration,
+            "bit_rate": self.bit_rate,
+            "video": {"codec_name": self.video_codec, "width": self.width, "height": self.height,
+                      "bit_rate": self.video_bit_rate, "r_frame_rate": self.r_frame_rate} if self.has_video else None,
+            "audio": {"codec_name": self.audio_codec, "bit_rate": self.audio_bit_rate} if self.has_audio else None
+        }
+
+
+def _key(path):
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+
+def probe(path, ffprobe='ffprobe'):
+    """Metadados do arquivo (formato e todos os streams).
+
+    O ffprobe roda uma vez por arquivo: o resultado fica em cache enquanto caminho, mtime e tamanho
+    não mudarem. Lança subprocess.CalledProcessError se o ffprobe não conseguir ler o arquivo.
+    """
+    key = _key(path)
+    with _cache_lock:
+        info = _cache.get(key)
+        if info is not None:
+            _cache.move_to_end(key)
+            return info
+
+    command = [
+        ffprobe,
+        '-v', 'error',
+        '-show_streams',
+        '-show_format',
+        '-of', 'json',
+        path
+    ]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
+    info = MediaInfo(path, json.loads(result.stdout or '{}'), key[2])
+    logging.debug(f"ffprobe {path}: {info.format_name}, {info.duration:.2f}s")
+
+    with _cache_lock:
+        _cache[key] = info
+        while len(_cache) > PROBE_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return info
+
+
+def rename(src, dst):
+    """Renomeia o arquivo mantendo os metadados já lidos, para não repetir o ffprobe no novo caminho."""
+    try:
+        old_key = _key(src)
+    except OSError:
+        old_key = None
+    os.rename(src, dst)
+    if old_key is None:
+        return
+    with _cache_lock:
+        info = _cache.pop(old_key, None)
+        if info is not None:
+            info.path = dst
+            _cache[(os.path.abspath(dst),) + old_key[1:]] = info
@@ -0,0 +1,150 @@
+import threading
+
+# Content-Type do formato de exposição de texto do Prometheus
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Faixas padrão (em segundos) para histogramas de duração
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in pairs]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric:
+    """Métrica com rótulos opcionais, exposta no formato de texto do Prometheus."""
+
+    type_name = 'untyped'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._function = None
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def set_function(self, function):
+        """Define uma função lida a cada coleta; ela devolve um valor ou um dicionário {rótulos: valor}."""
+        self._function = function
+
+    def samples(self):
+        if self._function is not None:
+            value = self._function()
+            if isinstance(value, dict):
+                return [('', key if isinstance(key, tuple) else (key,), amount) for key, amount in value.items()]
+            return [('', (), value)]
+        with self._lock:
+            return [('', key, value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        for suffix, key, value, *extra in self.samples():
+            labels = _format_labels(self.labelnames, key, extra[0] if extra else None)
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type_name = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        samples = []
+        for key, counts, total in items:
+            for bound, count in zip(self.buckets, counts):
+                samples.append(('_bucket', key, count, ('le', _format_value(bound))))
+            samples.append(('_sum', key, total))
+            samples.append(('_count', key, counts[-1]))
+        return samples
+
+
+class Registry:
+    """Conjunto de métricas do processo; registrar o mesmo nome duas vezes devolve a métrica existente."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, help_text, labelnames=(), **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, help_text, labelnames, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter, name, help_text, labelnames)
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._register(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+render = REGISTRY.render
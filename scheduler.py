@@ -0,0 +1,271 @@
+import os
+import json
+import logging
+import threading
+import time
+import itertools
+from collections import deque
+
+from whisper_backend import WHISPER_CPU_THREADS
+
+# Número de workers de transcrição (0 = calcular automaticamente a partir de CPUs e memória)
+TRANSCRIPTION_WORKERS = int(os.environ.get('TRANSCRIPTION_WORKERS', 0))
+
+# Limite de transcrições simultâneas por modelo, em JSON (ex.: '{"large-v2": 1, "medium": 2}')
+MODEL_CONCURRENCY = json.loads(os.environ.get('MODEL_CONCURRENCY', '{}'))
+
+# Memória de trabalho estimada (MB) de cada transcrição em andamento, além dos pesos do modelo
+WORKER_WORKING_SET_MB = 512
+
+# Peso de cada usuário na divisão dos workers, em JSON (ex.: '{"suporte": 2}'); o padrão é 1
+USER_WEIGHTS = json.loads(os.environ.get('USER_WEIGHTS', '{}'))
+
+# Segundos de áudio descontados do custo de um job por segundo de espera, para que os longos também avancem
+QUEUE_AGING_RATE = float(os.environ.get('QUEUE_AGING_RATE', 1.0))
+
+# Jobs que esperam mais que isso (s) passam à frente dos demais jobs do mesmo usuário
+MAX_QUEUE_WAIT_SECONDS = float(os.environ.get('MAX_QUEUE_WAIT_SECONDS', 600))
+
+# Custo (segundos de áudio) presumido quando a duração não pôde ser obtida no upload
+DEFAULT_JOB_SECONDS = 30.0
+
+
+def available_memory_mb():
+    """Memória física disponível em MB, ou None se não for possível obtê-la nesta plataforma."""
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def default_worker_count():
+    """Calcula o número de workers conforme os núcleos e a memória disponíveis."""
+    cpu_count = os.cpu_count() or 1
+    workers = max(1, cpu_count // max(1, WHISPER_CPU_THREADS))
+
+    memory_mb = available_memory_mb()
+    if memory_mb is not None:
+        workers = min(workers, max(1, memory_mb // WORKER_WORKING_SET_MB))
+    return workers
+
+
+class FairQueue:
+    """Fila com divisão justa ponderada entre usuários e prioridade para os áudios mais curtos.
+
+    Cada usuário tem um tempo virtual que avança com os segundos de áudio atendidos divididos pelo
+    seu peso. O próximo job é o de menor tempo virtual de término (tempo do usuário + duração / peso),
+    considerando de cada usuário o job mais curto, com o custo reduzido conforme o tempo de espera.
+    Um usuário com 200 arquivos não bloqueia os demais, e uma mensagem de 10 s passa à frente de um
+    áudio de 1 hora. Um job esperando mais que max_wait_seconds passa à frente dos outros jobs do
+    seu usuário; entre usuários continua valendo a divisão justa, para que o acúmulo antigo de um
+    usuário não volte a bloquear os demais.
+    Implementa put/get/qsize/task_done como queue.Queue; put(None) encerra um worker. get(runnable)
+    considera só os jobs aceitos por runnable e espera, sem consumir nada, até que wake() avise que
+    a condição mudou.
+    """
+
+    def __init__(self, weights=None, aging_rate=QUEUE_AGING_RATE, max_wait_seconds=MAX_QUEUE_WAIT_SECONDS):
+        self.weights = dict(USER_WEIGHTS if weights is None else weights)
+        self.aging_rate = aging_rate
+        self.max_wait_seconds = max_wait_seconds
+        self._pending = {}  # usuário -> lista de (enfileirado_em, sequência, custo, task)
+        self._virtual_time = {}  # usuário -> segundos de áudio atendidos / peso
+        self._clock = 0.0  # tempo virtual de início do último job atendido
+        self._control = deque()
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def weight(self, user_id):
+        return max(float(self.weights.get(user_id, 1)), 0.001)
+
+    def put(self, task):
+        with self._condition:
+            if task is None:
+                self._control.append(None)
+            else:
+                user_id = task.get('user_id') or ''
+                cost = float(task.get('audio_seconds') or DEFAULT_JOB_SECONDS)
+                if not self._pending.get(user_id):
+                    # Quem volta à fila entra no tempo virtual atual, sem acumular crédito enquanto esteve ausente
+                    self._virtual_time[user_id] = max(self._virtual_time.get(user_id, 0.0), self._clock)
+                self._pending.setdefault(user_id, []).append((time.monotonic(), next(self._sequence), cost, task))
+            self._condition.notify()
+
+    def get(self, runnable=None):
+        with self._condition:
+            while True:
+                if self._control:
+                    return self._control.popleft()
+                task = self._pop(runnable)
+                if task is not None:
+                    return task
+                self._condition.wait()
+
+    def wake(self):
+        """Reavalia os jobs pendentes (ex.: um modelo saturado liberou uma vaga)."""
+        with self._condition:
+            self._condition.notify_all()
+
+    def qsize(self):
+        with self._condition:
+            return sum(len(entries) for entries in self._pending.values())
+
+    def task_done(self):
+        pass
+
+    def stats(self):
+        """Jobs pendentes e tempo virtual de cada usuário com jobs na fila."""
+        with self._condition:
+            now = time.monotonic()
+            return {
+                user_id: {
+                    "pending": len(entries),
+                    "pending_audio_seconds": round(sum(entry[2] for entry in entries), 1),
+                    "oldest_wait_seconds": round(now - min(entry[0] for entry in entries), 1),
+                    "virtual_time": round(self._virtual_time.get(user_id, 0.0), 1),
+                    "weight": self.weight(user_id)
+                }
+                for user_id, entries in self._pending.items()
+            }
+
+    def _pop(self, runnable=None):
+        now = time.monotonic()
+        best = None
+        for candidate_user, entries in self._pending.items():
+            if runnable is not None:
+                # Jobs que não podem rodar agora (modelo sem vaga) ficam na fila sem bloquear os demais
+                entries = [entry for entry in entries if runnable(entry[3])]
+                if not entries:
+                    continue
+            oldest = min(entries, key=lambda e: e[:2])
+            if now - oldest[0] >= self.max_wait_seconds:
+                # Proteção contra inanição dentro do usuário: o job mais antigo dele é o candidato
+                entry = oldest
+            else:
+                # De cada usuário, o job mais curto, com desconto pelo tempo de espera
+                entry = min(entries, key=lambda e: (max(0.0, e[2] - self.aging_rate * (now - e[0])), e[1]))
+            effective_cost = max(0.0, entry[2] - self.aging_rate * (now - entry[0]))
+            finish = self._virtual_time[candidate_user] + effective_cost / self.weight(candidate_user)
+            if best is None or (finish, entry[1]) < (best[0], best[2][1]):
+                best = (finish, candidate_user, entry)
+        if best is None:
+            return None
+        _, user_id, entry = best
+
+        entries = self._pending[user_id]
+        entries.remove(entry)
+        if not entries:
+            del self._pending[user_id]
+        self._clock = max(self._clock, self._virtual_time[user_id])
+        # O usuário é cobrado pela duração real do áudio, sem o desconto de envelhecimento
+        self._virtual_time[user_id] += entry[2] / self.weight(user_id)
+        return entry[3]
+
+
+class TranscriptionScheduler:
+    """Distribui os jobs da fila entre N workers, respeitando o limite de concorrência de cada modelo.
+
+    Jobs de um modelo no limite ficam na fila enquanto os workers livres atendem os de outros modelos.
+    """
+
+    def __init__(self, handler, workers=None, model_concurrency=None, queue=None):
+        self.handler = handler
+        self.workers = workers or TRANSCRIPTION_WORKERS or default_worker_count()
+        self.model_concurrency = dict(MODEL_CONCURRENCY if model_concurrency is None else model_concurrency)
+        self.queue = queue if queue is not None else FairQueue()
+
+        self._lock = threading.Lock()
+        self._dispatch_lock = threading.Lock()  # um worker por vez escolhe e reserva o próximo job
+        self._running_by_model = {}
+        self._busy_workers = 0
+        self._busy_seconds = 0.0
+        self._processed = 0
+        self._failed = 0
+        self._started_at = None
+        self._threads = []
+
+    def start(self):
+        self._started_at = time.monotonic()
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"transcription-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logging.info(f"Agendador de transcrições iniciado com {self.workers} workers")
+
+    def submit(self, task):
+        """Adiciona um job (dicionário com ao menos 'config') à fila."""
+        self.queue.put(task)
+
+    def model_limit(self, model_name):
+        """Limite de execuções simultâneas do modelo (por padrão, o número de workers)."""
+        return int(self.model_concurrency.get(model_name, self.workers))
+
+    def stats(self):
+        """Profundidade da fila e utilização dos workers."""
+        # Consultada antes de self._lock: get() chama _can_run (que usa self._lock) com a fila travada
+        queue_depth = self.queue.qsize()
+        users = self.queue.stats() if hasattr(self.queue, 'stats') else {}
+        with self._lock:
+            uptime = time.monotonic() - self._started_at if self._started_at else 0
+            capacity = uptime * self.workers
+            return {
+                "queue_depth": queue_depth,
+                "workers": self.workers,
+                "busy_workers": self._busy_workers,
+                "utilisation": round(self._busy_seconds / capacity, 4) if capacity else 0.0,
+                "processed": self._processed,
+                "failed": self._failed,
+                "users": users,
+                "models": {
+                    model_name: {"running": running, "limit": self.model_limit(model_name)}
+                    for model_name, running in self._running_by_model.items()
+                }
+            }
+
+    @staticmethod
+    def _model_of(task):
+        return task.get('config', {}).get('model') or 'medium'
+
+    def _can_run(self, task):
+        """Se o modelo do job ainda tem vaga."""
+        model_name = self._model_of(task)
+        with self._lock:
+            return self._running_by_model.get(model_name, 0) < self.model_limit(model_name)
+
+    def _worker_loop(self):
+        while True:
+            # A vaga do modelo é reservada antes que outro worker escolha o seu job
+            with self._dispatch_lock:
+                task = self.queue.get(self._can_run)
+                if task is not None:
+                    model_name = self._model_of(task)
+                    with self._lock:
+                        self._running_by_model[model_name] = self._running_by_model.get(model_name, 0) + 1
+            if task is None:
+                self.queue.task_done()
+                break
+            try:
+                self._run(task, model_name)
+            finally:
+                self.queue.task_done()
+
+    def _run(self, task, model_name):
+        with self._lock:
+            self._busy_workers += 1
+        started = time.monotonic()
+        succeeded = False
+        try:
+            # O handler pode devolver False para sinalizar uma falha já tratada
+            succeeded = self.handler(task) is not False
+        except Exception as e:
+            logging.error(f"Erro não tratado no worker de transcrição: {e}")
+        finally:
+            with self._lock:
+                self._busy_workers -= 1
+                self._running_by_model[model_name] -= 1
+                self._busy_seconds += time.monotonic() - started
+                self._processed += 1
+                if not succeeded:
+                    self._failed += 1
+            # A vaga liberada pode destravar jobs desse modelo que estavam na fila
+            self.queue.wake()
@@ -0,0 +1,86 @@
+"""Substituto determinístico do faster-whisper-xxl para testes de carga da camada web.
+
+Aceita a mesma linha de comando (áudio, --language, --model, --output_dir, --beam_size,
+--chunk_length, --torch_dtype), espera um tempo configurável, imprime os segmentos como o
+executável real e grava <nome>.srt em --output_dir. Use com:
+
+    FASTER_WHISPER_PATH=stub_whisper.py TRANSCRIPTION_BACKEND=subprocess python transcribe_configurable_all.py
+
+Variáveis de ambiente:
+    STUB_WHISPER_DELAY      atraso fixo por chamada, em segundos (padrão 0.5)
+    STUB_WHISPER_RTF        atraso adicional proporcional à duração do áudio WAV (padrão 0)
+    STUB_WHISPER_FAIL_RATE  fração das chamadas que falham com código de saída 1 (padrão 0);
+                            a escolha depende só do nome do arquivo, para ser reproduzível
+"""
+import os
+import sys
+import time
+import wave
+import zlib
+import argparse
+
+SEGMENT_SECONDS = 2.0
+
+PHRASES = [
+    "Oi, tudo bem?",
+    "Estou mandando esse áudio para confirmar o horário.",
+    "Pode ser amanhã às dez horas.",
+    "Qualquer coisa me avisa.",
+]
+
+
+def audio_duration(path):
+    """Duração do WAV em segundos; para outros formatos, assume um áudio curto."""
+    try:
+        with wave.open(path, 'rb') as wav_file:
+            return wav_file.getnframes() / wav_file.getframerate()
+    except (wave.Error, EOFError, OSError):
+        return 3 * SEGMENT_SECONDS
+
+
+def format_timestamp(seconds, separator):
+    millis = int(round(seconds * 1000))
+    hours, millis = divmod(millis, 3600000)
+    minutes, millis = divmod(millis, 60000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02}:{minutes:02}:{secs:02}{separator}{millis:03}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('audio')
+    parser.add_argument('--output_dir', required=True)
+    parser.add_argument('--language')
+    parser.add_argument('--model')
+    parser.add_argument('--beam_size')
+    parser.add_argument('--chunk_length')
+    parser.add_argument('--torch_dtype')
+    args, _ = parser.parse_known_args(argv)
+
+    name = os.path.splitext(os.path.basename(args.audio))[0]
+    duration = audio_duration(args.audio)
+
+    fail_rate = float(os.environ.get('STUB_WHISPER_FAIL_RATE', 0))
+    if fail_rate and (zlib.crc32(name.encode()) % 10000) / 10000 < fail_rate:
+        print(f"Falha simulada para {name}", file=sys.stderr)
+        return 1
+
+    time.sleep(float(os.environ.get('STUB_WHISPER_DELAY', 0.5)) +
+               float(os.environ.get('STUB_WHISPER_RTF', 0)) * duration)
+
+    cues = []
+    start = 0.0
+    while start < duration:
+        end = min(start + SEGMENT_SECONDS, duration)
+        text = PHRASES[len(cues) % len(PHRASES)]
+        print(f"[{format_timestamp(start, '.')} --> {format_timestamp(end, '.')}] {text}", flush=True)
+        cues.append(f"{len(cues) + 1}\n{format_timestamp(start, ',')} --> {format_timestamp(end, ',')}\n{text}\n")
+        start = end
+
+    with open(os.path.join(args.output_dir, name + '.srt'), 'w', encoding='utf-8') as f:
+        f.write("\n".join(cues))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
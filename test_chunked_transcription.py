@@ -0,0 +1,42 @@
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pytest
+
+import chunked_transcription
+import whisper_backend
+
+
+class BrokenExecutor:
+    def __init__(self):
+        self.shut_down = False
+
+    def submit(self, *args, **kwargs):
+        future = Future()
+        future.set_exception(BrokenProcessPool("processo encerrado"))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shut_down = True
+
+
+def test_broken_pool_is_replaced_for_the_next_job(monkeypatch, tmp_path):
+    broken = BrokenExecutor()
+    monkeypatch.setattr(chunked_transcription, '_executor', broken)
+    pcm = np.zeros(16000 * 5, dtype=np.int16)
+
+    with pytest.raises(BrokenProcessPool):
+        chunked_transcription.transcribe_in_chunks(pcm, str(tmp_path / 'out.srt'), {}, 'stub_whisper.py')
+
+    assert broken.shut_down
+    assert chunked_transcription._executor is None
+
+
+def test_default_chunk_workers_fit_the_memory_budget(monkeypatch):
+    monkeypatch.setattr(chunked_transcription, 'CHUNK_WORKERS', 0)
+    monkeypatch.setattr(chunked_transcription.os, 'cpu_count', lambda: 64)
+    monkeypatch.setattr(whisper_backend, 'WHISPER_CPU_THREADS', 4)
+    monkeypatch.setattr(whisper_backend, 'WHISPER_POOL_MEMORY_MB', 4000)
+    # 'medium' no compute type padrão ocupa cerca de 1500 MB
+    assert chunked_transcription.chunk_worker_count() == 2
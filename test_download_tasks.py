@@ -0,0 +1,45 @@
+import importlib
+
+import pytest
+
+
+@pytest.fixture
+def download_videos(tmp_path, monkeypatch):
+    # O módulo cria logs/, downloads/ e os bancos no diretório atual
+    monkeypatch.chdir(tmp_path)
+    module = importlib.import_module('download_videos')
+    monkeypatch.setattr(module, 'DATABASE', str(tmp_path / 'tasks.db'))
+    monkeypatch.setattr(module._db_local, 'conn', None, raising=False)
+    module.init_db()
+    return module
+
+
+def test_restart_fails_in_flight_tasks_so_they_can_be_resubmitted(download_videos, monkeypatch):
+    download_videos.update_task_status('r1', 'u1', 'QUEUED')
+    download_videos.update_task_status('r2', 'u1', 'STARTED', progress='downloading')
+    download_videos.update_task_status('r3', 'u1', 'COMPLETED', result={"number_of_videos": 1})
+
+    client = download_videos.app.test_client()
+    body = {'url': 'https://example.com/v', 'id_request': 'r1', 'id_user': 'u1'}
+    assert client.post('/download', json=body).status_code == 409
+
+    # Reinício: as tarefas em andamento não têm mais worker
+    assert download_videos.fail_interrupted_tasks() == 2
+    assert download_videos.get_task('u1', 'r1')['status'] == 'FAILED'
+    assert download_videos.get_task('u1', 'r2')['error_message'] == "Interrupted by a service restart"
+    assert download_videos.get_task('u1', 'r3')['status'] == 'COMPLETED'
+
+    submitted = []
+    monkeypatch.setattr(download_videos.executor, 'submit', lambda *args, **kwargs: submitted.append(args))
+    response = client.post('/download', json=body)
+    assert response.status_code == 202
+    assert download_videos.get_task('u1', 'r1')['status'] == 'QUEUED'
+    assert len(submitted) == 1
+
+
+def test_transcription_config_parses_remove_audio_like_upload(download_videos):
+    config = download_videos.transcription_config
+    assert config({'remove_audio_after_transcription': 'false'})['remove_audio_after_transcription'] is False
+    assert config({'remove_audio_after_transcription': 'True'})['remove_audio_after_transcription'] is True
+    assert config({'remove_audio_after_transcription': True})['remove_audio_after_transcription'] is True
+    assert config({})['remove_audio_after_transcription'] is False
@@ -0,0 +1,43 @@
+from job_store import JobStore
+from jobs import STATUS_COMPLETED
+
+
+def test_cached_job_is_persisted_as_completed(tmp_path):
+    store = JobStore(path=str(tmp_path / 'jobs.db'))
+    store.record_completed('j1', 'u1', 'r1', {"srt_path": "r1.srt", "cached": True})
+
+    # Outro processo (ou o mesmo após um reinício) encontra o job concluído, e ele nunca volta à fila
+    stored = JobStore(path=str(tmp_path / 'jobs.db'), owner='B').get('j1')
+    assert stored['status'] == STATUS_COMPLETED
+    assert stored['result']['cached'] is True
+    assert store.undispatched() == []
+
+
+def test_undispatched_reads_only_new_queue_entries(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    a = JobStore(path=path, owner='A', lease_seconds=60)
+    b = JobStore(path=path, owner='B', lease_seconds=60)
+    a.enqueue('j1', 'u1', 'r1', {'job_id': 'j1'})
+    a.enqueue('j2', 'u1', 'r2', {'job_id': 'j2'}, dispatched=False)
+
+    # A já tem j1 na fila em memória; B vê os dois, e cada job é entregue uma única vez
+    assert [job[0] for job in a.undispatched()] == ['j2']
+    assert [job[0] for job in b.undispatched()] == ['j1', 'j2']
+    assert b.undispatched() == []
+
+    # Um job devolvido à fila por concessão expirada volta a ser entregue a quem já o consumiu;
+    # A ainda o tem na fila em memória
+    assert b.claim('j1')
+    b._connection().execute('UPDATE jobs SET lease_expires = 0 WHERE id = ?', ('j1',))
+    assert a.requeue_expired() == 1
+    assert a.undispatched() == []
+    assert [job[0] for job in b.undispatched()] == ['j1']
+
+
+def test_jobs_queued_before_the_event_table_are_recovered(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    JobStore(path=path, owner='A').enqueue('j1', 'u1', 'r1', {'job_id': 'j1'})
+    JobStore(path=path, owner='A')._connection().execute('DROP TABLE queue_events')
+
+    restarted = JobStore(path=path, owner='A2')
+    assert [job[0] for job in restarted.undispatched()] == ['j1']
@@ -0,0 +1,106 @@
+import threading
+
+import pytest
+
+import scheduler
+from scheduler import FairQueue, TranscriptionScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(scheduler.time, 'monotonic', fake)
+    return fake
+
+
+def job(user_id, seconds, name):
+    return {'user_id': user_id, 'audio_seconds': seconds, 'name': name}
+
+
+def test_light_user_is_served_promptly_behind_aged_backlog(clock):
+    queue = FairQueue(weights={}, aging_rate=1.0, max_wait_seconds=600)
+    for index in range(200):
+        queue.put(job('A', 30, f'A{index}'))
+
+    # Um worker atende um job de 30 s por vez; B chega quando o acúmulo de A já passou do prazo
+    served = []
+    while clock.now < 750:
+        served.append(queue.get()['name'])
+        clock.now += 30
+    queue.put(job('B', 10, 'B0'))
+
+    next_jobs = [queue.get()['name'] for _ in range(2)]
+    assert 'B0' in next_jobs
+
+
+def test_deadline_applies_within_the_user_queue(clock):
+    queue = FairQueue(weights={}, aging_rate=0.0, max_wait_seconds=600)
+    queue.put(job('A', 3600, 'long'))
+    clock.now = 1
+    for index in range(3):
+        queue.put(job('A', 10, f'short{index}'))
+
+    # Antes do prazo, os curtos do próprio usuário passam à frente do longo
+    assert queue.get()['name'] == 'short0'
+    # Depois do prazo, o longo é o próximo do usuário
+    clock.now = 700
+    assert queue.get()['name'] == 'long'
+
+
+def test_weighted_share_between_users(clock):
+    queue = FairQueue(weights={'A': 2}, aging_rate=0.0, max_wait_seconds=600)
+    for index in range(30):
+        queue.put(job('A', 10, f'A{index}'))
+        queue.put(job('B', 10, f'B{index}'))
+    first = [queue.get()['name'][0] for _ in range(30)]
+    assert first.count('A') == 20
+    assert first.count('B') == 10
+
+
+def test_get_skips_jobs_that_cannot_run(clock):
+    queue = FairQueue(weights={}, aging_rate=0.0, max_wait_seconds=600)
+    queue.put(job('A', 5, 'blocked'))
+    queue.put(job('B', 50, 'free'))
+    assert queue.get(lambda task: task['name'] != 'blocked')['name'] == 'free'
+    assert queue.qsize() == 1
+
+
+def test_saturated_model_does_not_hold_free_workers():
+    release = threading.Event()
+    started = []
+    medium_done = threading.Event()
+    all_done = threading.Event()
+
+    def handler(task):
+        started.append(task['name'])
+        if task['config']['model'] == 'large-v2':
+            release.wait(5)
+        else:
+            medium_done.set()
+        if len(started) == 3:
+            all_done.set()
+
+    pool = TranscriptionScheduler(handler, workers=2, model_concurrency={'large-v2': 1})
+    pool.submit({'user_id': 'A', 'audio_seconds': 10, 'name': 'large0', 'config': {'model': 'large-v2'}})
+    pool.submit({'user_id': 'A', 'audio_seconds': 10, 'name': 'large1', 'config': {'model': 'large-v2'}})
+    pool.submit({'user_id': 'A', 'audio_seconds': 20, 'name': 'medium0', 'config': {'model': 'medium'}})
+    pool.start()
+
+    # O segundo worker atende o job do medium em vez de esperar a vaga do large-v2
+    assert medium_done.wait(5)
+    assert 'large1' not in started
+    release.set()
+    assert all_done.wait(5)
+    for _ in range(pool.workers):
+        pool.submit(None)
+    for thread in pool._threads:
+        thread.join(5)
+    assert sorted(started) == ['large0', 'large1', 'medium0']
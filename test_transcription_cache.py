@@ -0,0 +1,20 @@
+import os
+
+from transcription_cache import TranscriptionCache
+
+
+def test_entry_with_missing_files_is_a_miss(tmp_path):
+    cache = TranscriptionCache(folder=str(tmp_path / 'cache'))
+    srt = tmp_path / 'a.srt'
+    html = tmp_path / 'a.html'
+    srt.write_text('1\n00:00:00,000 --> 00:00:01,000\noi\n', encoding='utf-8')
+    html.write_text('<p>oi</p>', encoding='utf-8')
+    cache.put('k', str(srt), str(html))
+
+    assert cache.get('k', str(tmp_path / 'b.srt'), str(tmp_path / 'b.html')) is True
+
+    # Arquivos apagados por um descarte concorrente (ou à mão) não viram um erro 500
+    os.remove(cache._path('k', '.srt'))
+    assert cache.get('k', str(tmp_path / 'c.srt'), str(tmp_path / 'c.html')) is None
+    assert cache.stats()['entries'] == 0
+    assert (cache.hits, cache.misses) == (1, 1)
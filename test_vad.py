@@ -0,0 +1,59 @@
+import numpy as np
+
+import vad
+from audio_decode import SAMPLE_RATE
+
+
+def to_pcm(signal):
+    return (np.clip(signal, -1, 1) * 32767).astype(np.int16)
+
+
+def speech_like(seconds, rng, pauses=True):
+    """Rajadas de ruído moduladas como sílabas (~4 Hz), com ou sem pausas entre as frases."""
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    envelope = 0.5 * (1 + np.sin(2 * np.pi * 4 * t))
+    if pauses:
+        envelope[(t % 2.0) > 1.5] = 0.0
+    return rng.normal(0, 0.2, len(t)) * envelope
+
+
+def test_noisy_speech_is_not_silent():
+    rng = np.random.default_rng(0)
+    speech = speech_like(10, rng)
+    # Ruído com SNR de 5 dB em relação à fala
+    noise_rms = np.sqrt(np.mean(speech ** 2)) / 10 ** (5 / 20)
+    stats = vad.analyze(to_pcm(speech + rng.normal(0, noise_rms, len(speech))))
+    assert not stats["silent"]
+    assert stats["speech_seconds"] > 5
+
+
+def test_constant_level_speech_is_not_silent_nor_trimmed():
+    rng = np.random.default_rng(1)
+    pcm = to_pcm(rng.normal(0, 0.1, 10 * SAMPLE_RATE))
+    stats = vad.analyze(pcm)
+    assert not stats["silent"]
+    assert stats["speech_seconds"] > 9
+    assert (stats["start"], stats["end"]) == (0, len(pcm))
+
+
+def test_steady_tone_is_not_silent():
+    t = np.arange(5 * SAMPLE_RATE) / SAMPLE_RATE
+    stats = vad.analyze(to_pcm(0.3 * np.sin(2 * np.pi * 440 * t)))
+    assert not stats["silent"]
+
+
+def test_digital_silence_is_silent():
+    stats = vad.analyze(np.zeros(5 * SAMPLE_RATE, dtype=np.int16))
+    assert stats["silent"]
+    assert stats["speech_seconds"] == 0
+
+
+def test_long_leading_and_trailing_silence_is_trimmed():
+    rng = np.random.default_rng(2)
+    quiet = rng.normal(0, 0.001, 3 * SAMPLE_RATE)  # ruído de fundo baixo, acima de -50 dBFS
+    speech = speech_like(4, rng, pauses=False)
+    pcm = to_pcm(np.concatenate([quiet, speech, quiet]))
+    stats = vad.analyze(pcm)
+    assert not stats["silent"]
+    assert 2 * SAMPLE_RATE < stats["start"] < 3 * SAMPLE_RATE
+    assert len(pcm) - 3 * SAMPLE_RATE < stats["end"] < len(pcm) - 2 * SAMPLE_RATE
@@ -0,0 +1,27 @@
+import os
+
+import numpy as np
+import pysrt
+
+import whisper_backend
+from audio_decode import write_wav
+
+STUB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stub_whisper.py')
+
+
+def test_executable_fallback_keeps_the_input_wav(monkeypatch, tmp_path):
+    monkeypatch.setattr(whisper_backend, 'in_process_enabled', lambda: False)
+    monkeypatch.setenv('STUB_WHISPER_DELAY', '0')
+    # Upload .wav cujo nome coincide com o do job, na mesma pasta usada como work_dir
+    source = tmp_path / 'job.wav'
+    original = (np.random.RandomState(0).randn(16000 * 4) * 3000).astype(np.int16)
+    write_wav(str(source), original)
+    before = source.read_bytes()
+
+    trimmed = original[:16000 * 2]
+    whisper_backend.transcribe_pcm(trimmed, 'job', str(tmp_path), {}, STUB, str(tmp_path), offset_seconds=1.0)
+
+    assert source.read_bytes() == before
+    subs = pysrt.open(str(tmp_path / 'job.srt'), encoding='utf-8')
+    assert subs[0].start.ordinal == 1000
+    assert sorted(os.listdir(tmp_path)) == ['job.srt', 'job.wav']
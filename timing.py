@@ -0,0 +1,81 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Cronômetro ativo na thread atual (as etapas medidas em outros módulos são somadas a ele)
+_current = threading.local()
+
+
+class StageTimer:
+    """Tempo gasto (em segundos) em cada etapa de um job, na ordem em que as etapas ocorreram."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.finished_at = None
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        """Soma a duração à etapa (etapas repetidas, como a espera pelo lock, são acumuladas)."""
+        with self._lock:
+            self._stages[stage] = self._stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def measure(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def finish(self):
+        self.finished_at = time.time()
+
+    def to_dict(self):
+        with self._lock:
+            stages = {stage: round(seconds, 4) for stage, seconds in self._stages.items()}
+        end = self.finished_at or time.time()
+        return {
+            "stages": stages,
+            "total_seconds": round(end - self.started_at, 4),
+            # Tempo não coberto por nenhuma etapa (roteamento, respostas HTTP, trocas de thread...)
+            "unaccounted_seconds": round(max(0.0, end - self.started_at - sum(stages.values())), 4)
+        }
+
+    def save(self, path):
+        """Grava o registro de tempos em JSON ao lado dos arquivos da transcrição."""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+@contextmanager
+def activate(timer):
+    """Define o cronômetro da thread atual enquanto o bloco estiver ativo."""
+    previous = getattr(_current, 'timer', None)
+    _current.timer = timer
+    try:
+        yield timer
+    finally:
+        _current.timer = previous
+
+
+def current():
+    return getattr(_current, 'timer', None)
+
+
+def record(stage, seconds):
+    """Registra a duração no cronômetro da thread atual; sem cronômetro ativo, não faz nada."""
+    timer = current()
+    if timer is not None:
+        timer.record(stage, seconds)
+
+
+@contextmanager
+def measure(stage):
+    timer = current()
+    if timer is None:
+        yield
+        return
+    with timer.measure(stage):
+        yield
@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, send_from_directory, render_template_string
+from flask import Flask, request, jsonify, send_from_directory, render_template_string, Response
 import os
 import subprocess
 import logging
@@ -6,18 +6,24 @@ import pysrt
 from queue import Queue
 from threading import Thread, Lock
 import time
+import whisper_backend
+import metrics
+from upload_spool import configure_spooling, take_spooled_upload, discard_upload
 
 app = Flask(__name__)
 
 logging.basicConfig(level=logging.INFO)
 
-# Caminho para o executável
-FASTER_WHISPER_PATH = r"faster-whisper-xxl.exe"
+# Caminho para o executável (FASTER_WHISPER_PATH=stub_whisper.py roda os testes de carga sem o modelo)
+FASTER_WHISPER_PATH = os.environ.get('FASTER_WHISPER_PATH', r"faster-whisper-xxl.exe")
 UPLOAD_FOLDER = 'audios'
 OUTPUT_FOLDER = 'transcriptions'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
+# Uploads são gravados em blocos em arquivos de spool únicos (evita que envios com o mesmo nome se sobrescrevam)
+configure_spooling(app, UPLOAD_FOLDER)
+
 # Configuração da fila de transcrição
 transcription_queue = Queue()
 queue_lock = Lock()
@@ -25,15 +31,25 @@ queue_lock = Lock()
 # Lock para garantir que apenas uma transcrição ocorra por vez
 transcription_lock = Lock()
 
+# Métricas expostas em /metrics no formato do Prometheus
+QUEUE_WAIT_SECONDS = metrics.histogram('transcription_queue_wait_seconds', 'Tempo entre o upload e o início da transcrição')
+INFERENCE_SECONDS = metrics.histogram('transcription_inference_seconds', 'Tempo de transcrição de cada arquivo')
+JOB_OUTCOMES = metrics.counter('transcription_jobs_total', 'Transcrições concluídas, por resultado', ('outcome',))
+metrics.gauge('transcription_queue_depth', 'Transcrições aguardando na fila').set_function(lambda: transcription_queue.qsize())
+
 # Função para processar a fila de transcrições
 def process_queue():
     while True:
-        audio_path, request_folder = transcription_queue.get()
+        audio_path, request_folder, enqueued_at = transcription_queue.get()
         if audio_path is None:
             break
         try:
             with transcription_lock:  # Garante que apenas uma transcrição ocorra por vez
-                transcribe_audio(audio_path, request_folder)
+                QUEUE_WAIT_SECONDS.observe(time.time() - enqueued_at)
+                inference_start = time.time()
+                transcribed = transcribe_audio(audio_path, request_folder)
+                INFERENCE_SECONDS.observe(time.time() - inference_start)
+                JOB_OUTCOMES.inc(outcome='completed' if transcribed else 'failed')
         finally:
             transcription_queue.task_done()
 
@@ -44,15 +60,8 @@ thread.start()
 # Função para chamar o executável de transcrição
 def transcribe_audio(audio_path, request_folder):
     try:
-        command = [
-            FASTER_WHISPER_PATH,
-            audio_path,
-            '--language', 'Portuguese',
-            '--model', 'medium',  # Ajuste o modelo conforme necessário
-            '--output_dir', request_folder
-        ]
-        logging.info(f"Executing command: {' '.join(command)}")
-        subprocess.run(command, check=True)
+        # Usa o modelo residente em memória quando disponível; o executável fica como alternativa
+        whisper_backend.transcribe_file(audio_path, request_folder, {'model': 'medium'}, FASTER_WHISPER_PATH)
         logging.info(f"Transcription completed and saved to {request_folder}")
         return True
     except subprocess.CalledProcessError as e:
@@ -99,16 +108,18 @@ def upload_file():
 
     file = request.files['file']
     if file.filename == '':
+        discard_upload(file)
         return jsonify({"error": "No selected file"}), 400
 
     user_id = request.form.get('user_id')
     request_id = request.form.get('request_id')
 
     if not user_id or not request_id:
+        discard_upload(file)
         return jsonify({"error": "User ID and Request ID are required"}), 400
 
-    file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-    file.save(file_path)
+    # O arquivo já foi gravado em blocos, com nome único, durante a leitura da requisição
+    file_path, _ = take_spooled_upload(file)
 
     request_folder = create_directories(user_id, request_id)
     srt_path = os.path.join(request_folder, f'{request_id}.srt')
@@ -117,7 +128,7 @@ def upload_file():
     try:
         # Adiciona a transcrição à fila
         with queue_lock:
-            transcription_queue.put((file_path, request_folder))
+            transcription_queue.put((file_path, request_folder, time.time()))
 
         # Espera o processamento da fila para garantir a conclusão
         transcription_queue.join()
@@ -149,6 +160,11 @@ def upload_file():
         if os.path.exists(file_path):
             os.remove(file_path)
 
+# Rota com as métricas no formato do Prometheus
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 # Rota para servir transcrições
 @app.route('/transcriptions/', defaults={'subpath': ''})
 @app.route('/transcriptions/<path:subpath>')
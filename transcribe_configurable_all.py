@@ -1,129 +1,288 @@
-from flask import Flask, request, jsonify, send_from_directory, render_template_string
+from flask import Flask, request, jsonify, send_from_directory, render_template_string, Response, stream_with_context
 import os
+import json
 import subprocess
 import logging
 import pysrt
-from queue import Queue
-from threading import Thread, Lock
 import time
-import shutil  # Import necessário para remover vídeos após a extração do áudio
-from lock import acquire_lock, release_lock
+import shutil
+from lock import acquire_lock, release_lock, PRIORITY_HIGH
+from jobs import JobRegistry, STATUS_QUEUED, STATUS_RUNNING, STATUS_COMPLETED, STATUS_FAILED
+from job_store import JobStore
+from scheduler import TranscriptionScheduler
+from transcription_cache import TranscriptionCache, make_cache_key
+from upload_spool import configure_spooling, take_spooled_upload, discard_upload
+from audio_decode import SAMPLE_RATE, decode_pcm, probe_duration, write_wav
+import vad
+import adaptive
+import chunked_transcription
+import metrics
+import timing
+import whisper_backend
 
 
 app = Flask(__name__)
 
 logging.basicConfig(level=logging.INFO)
 
-# Caminho para o executável
-FASTER_WHISPER_PATH = r"faster-whisper-xxl.exe"
+# Caminho para o executável (FASTER_WHISPER_PATH=stub_whisper.py roda os testes de carga sem o modelo)
+FASTER_WHISPER_PATH = os.environ.get('FASTER_WHISPER_PATH', r"faster-whisper-xxl.exe")
 UPLOAD_FOLDER = 'uploads'  # Alterei o nome da pasta para refletir melhor que ela lida com áudios e vídeos
 OUTPUT_FOLDER = 'transcriptions'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
-# Configuração da fila de transcrição
-transcription_queue = Queue()
-queue_lock = Lock()
-
-# Lock para garantir que apenas uma transcrição ocorra por vez
-transcription_lock = Lock()
-
-# Função para processar a fila de transcrições
-def process_queue():
+# Formatos aceitos; todos são decodificados direto para PCM pelo ffmpeg
+VIDEO_EXTENSIONS = ['.mp4', '.mkv', '.avi', '.webm']
+AUDIO_EXTENSIONS = ['.wav', '.mp3', '.aac', '.ogg', '.opus', '.m4a']
+
+# Uploads são gravados em blocos em arquivos de spool únicos, com hash calculado durante a leitura
+configure_spooling(app, UPLOAD_FOLDER)
+
+# Registro dos jobs de transcrição (consultado por /jobs/<job_id>)
+job_registry = JobRegistry()
+
+# Fila persistente (SQLite/WAL): jobs pendentes sobrevivem a reinícios e quedas do processo
+job_store = JobStore()
+
+# Tempo máximo (em segundos) que uma requisição de long-poll pode aguardar
+MAX_LONG_POLL_SECONDS = 60
+
+# Intervalo (em segundos) entre comentários de keep-alive no stream de segmentos
+SSE_HEARTBEAT_SECONDS = 15
+
+# Tempo máximo (em segundos) que um /upload síncrono aguarda a transcrição antes de responder 504
+SYNC_WAIT_SECONDS = float(os.environ.get('SYNC_WAIT_SECONDS', 3600))
+
+# Intervalo (em segundos) entre consultas à fila persistente enquanto o job roda em outro processo
+STORE_POLL_SECONDS = 2
+
+# Cache de transcrições endereçado pelo conteúdo do áudio e pela configuração de decodificação
+transcription_cache = TranscriptionCache()
+
+# Grava o áudio decodificado (WAV 16 kHz mono) na pasta da requisição; por padrão ele fica só em memória
+SAVE_EXTRACTED_AUDIO = os.environ.get('SAVE_EXTRACTED_AUDIO', 'false').lower() == 'true'
+
+# Lock global da GPU; em 'auto' (padrão) só é usado quando há GPU, pois em nós só com CPU ele serializaria os workers
+USE_GPU_LOCK = os.environ.get('USE_GPU_LOCK', 'auto').lower()
+if USE_GPU_LOCK == 'auto':
+    USE_GPU_LOCK = whisper_backend.WHISPER_DEVICE == 'cuda' or (
+        whisper_backend.WHISPER_DEVICE == 'auto' and shutil.which('nvidia-smi') is not None)
+else:
+    USE_GPU_LOCK = USE_GPU_LOCK == 'true'
+
+# Política que troca modelo/beam por opções mais rápidas quando a fila ameaça o SLO de latência
+adaptive_policy = adaptive.AdaptivePolicy()
+
+# Métricas expostas em /metrics (formato Prometheus)
+QUEUE_WAIT_SECONDS = metrics.histogram('transcription_queue_wait_seconds', 'Tempo entre o upload e o início da transcrição')
+REAL_TIME_FACTOR = metrics.histogram('transcription_real_time_factor', 'Tempo de transcrição dividido pela duração do áudio',
+                                     ('model',), buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 3, 5))
+EXTRACTION_SECONDS = metrics.histogram('ffmpeg_extraction_seconds', 'Tempo de decodificação do áudio pelo ffmpeg')
+EXTRACTION_BYTES = metrics.counter('ffmpeg_extraction_bytes_total', 'Bytes de mídia decodificados pelo ffmpeg')
+JOB_OUTCOMES = metrics.counter('transcription_jobs_total', 'Jobs de transcrição concluídos, por resultado', ('outcome',))
+CACHE_LOOKUPS = metrics.counter('transcription_cache_lookups_total', 'Consultas ao cache de transcrições', ('result',))
+ADAPTIVE_DOWNGRADES = metrics.counter('transcription_adaptive_downgrades_total',
+                                      'Jobs rebaixados pela política adaptativa', ('requested_model', 'effective_model'))
+CACHE_LOOKUPS.set_function(lambda: {'hit': transcription_cache.hits, 'miss': transcription_cache.misses})
+
+# Função executada pelos workers do agendador para cada job da fila
+def process_job(task):
+    job_id = task['job_id']
+    media_path = task['media_path']
+    request_folder = task['request_folder']
+    config = task['config']
+    # Outro processo (ou uma entrega repetida) pode ter assumido o job antes; o registro passa a refletir a fila persistente
+    if not job_store.claim(job_id):
+        logging.info(f"Job {job_id} já foi assumido por outro worker")
+        sync_job_from_store(job_id)
+        return True
+    job = job_registry.get(job_id)
+    timer = job.timer or timing.StageTimer()
+    service_start = time.time()
+    if 'enqueued_at' in task:
+        queue_wait = time.time() - task['enqueued_at']
+        QUEUE_WAIT_SECONDS.observe(queue_wait)
+        timer.record('queue_wait', queue_wait)
+    try:
+        job_registry.mark_running(job_id)
+        # Cada segmento decodificado é publicado no job para o stream em /jobs/<job_id>/stream
+        on_segment = lambda start, end, text: job_registry.add_segment(job_id, start, end, text)
+        # As etapas medidas nesta thread (lock, modelo, ffmpeg...) são registradas no cronômetro do job
+        with timing.activate(timer):
+            transcribed, vad_stats = handle_media(media_path, request_folder, config, on_segment)
+            result = finalize_transcription(request_folder, job.request_id)
+            if vad_stats:
+                result['vad'] = vad_stats
+            result['requested_config'] = task.get('requested_config', config)
+            result['effective_config'] = config
+            # Só guarda no cache quando o modelo rodou com sucesso (falhas e descartes do VAD não viram "sem conteúdo")
+            if transcribed and task.get('cache_key'):
+                with timing.measure('cache_store'):
+                    transcription_cache.put(task['cache_key'], result['srt_path'], result['html_path'])
+        result['timing'] = save_timing(timer, request_folder, job.request_id)
+        adaptive_policy.observe_job(time.time() - service_start)
+        job_store.complete(job_id, result)
+        job_registry.complete(job_id, result)
+        JOB_OUTCOMES.inc(outcome='completed' if result['srt_path'] else 'no_transcribable_content')
+        return True
+    except Exception as e:
+        logging.error(f"Erro inesperado no job {job_id}: {e}")
+        save_timing(timer, request_folder, job.request_id)
+        job_store.fail(job_id, f"Erro inesperado: {str(e)}")
+        job_registry.fail(job_id, f"Erro inesperado: {str(e)}")
+        JOB_OUTCOMES.inc(outcome='failed')
+        return False
+    finally:
+        if os.path.exists(media_path):
+            os.remove(media_path)
+
+# Função que espelha no registro em memória o estado persistido do job (ex.: processado por outro processo)
+def sync_job_from_store(job_id):
+    job = job_registry.get(job_id)
+    if job is None or job.finished:
+        return job
+    stored = job_store.get(job_id)
+    if stored is None:
+        return job
+    if stored['status'] == STATUS_COMPLETED:
+        job_registry.complete(job_id, stored['result'])
+    elif stored['status'] == STATUS_FAILED:
+        job_registry.fail(job_id, stored['error'])
+    elif stored['status'] == STATUS_RUNNING and job.status == STATUS_QUEUED:
+        job_registry.mark_running(job_id)
+    return job
+
+# Função que aguarda o fim do job (até timeout segundos), consultando também a fila persistente
+def wait_for_job(job_id, timeout):
+    deadline = time.monotonic() + timeout
     while True:
-        media_path, request_folder, config = transcription_queue.get()
-        if media_path is None:
-            break
-        try:
-            with transcription_lock:  # Garantindo que apenas uma transcrição ocorra por vez
-                handle_media(media_path, request_folder, config)
-        finally:
-            transcription_queue.task_done()
-
-# Inicia a thread para processamento de transcrições em segundo plano
-thread = Thread(target=process_queue, daemon=True)
-thread.start()
-# Função para extrair áudio de vídeos de maneira robusta
+        remaining = deadline - time.monotonic()
+        job = job_registry.wait(job_id, timeout=max(0, min(STORE_POLL_SECONDS, remaining)))
+        if job is None or job.finished:
+            return job
+        job = sync_job_from_store(job_id)
+        if job.finished or time.monotonic() >= deadline:
+            return job
+
+# Função para encerrar o cronômetro do job e gravá-lo como <request_id>_timing.json
+def save_timing(timer, request_folder, request_id):
+    timer.finish()
+    try:
+        timer.save(os.path.join(request_folder, f'{request_id}_timing.json'))
+    except OSError as e:
+        logging.error(f"Falha ao gravar os tempos da requisição {request_id}: {e}")
+    return timer.to_dict()
+
+# Agendador com múltiplos workers e limite de concorrência por modelo
+scheduler = TranscriptionScheduler(process_job)
+
+# Função chamada para jobs persistidos que não estão na fila em memória (recuperados após um reinício,
+# devolvidos por concessão expirada ou inseridos por outro processo)
+def dispatch_stored_job(job_id, user_id, request_id, task):
+    if job_registry.get(job_id) is None:
+        job_registry.create(user_id, request_id, task['config'], job_id=job_id)
+    logging.info(f"Job {job_id} recuperado da fila persistente")
+    scheduler.submit(task)
+
+# Inicia os workers e a manutenção da fila persistente; chamada só pelo processo que atende as requisições,
+# pois os processos dos trechos (spawn) também importam este módulo
+def start_services():
+    scheduler.start()
+    job_store.start_maintenance(dispatch_stored_job)
+
+metrics.gauge('transcription_queue_depth', 'Jobs aguardando um worker').set_function(lambda: scheduler.queue.qsize())
+metrics.gauge('transcription_busy_workers', 'Workers transcrevendo no momento').set_function(
+    lambda: scheduler.stats()['busy_workers'])
+
+# Adquire o lock da GPU somente quando habilitado (transcrições têm prioridade sobre transcodificações)
+def acquire_gpu_lock():
+    if USE_GPU_LOCK:
+        acquire_lock(priority=PRIORITY_HIGH)
+
+def release_gpu_lock():
+    if USE_GPU_LOCK:
+        release_lock()
 
-def extract_audio_from_video(video_path, audio_output_path):
-    """Extrai o áudio de um vídeo e salva no formato .wav, com suporte a múltiplos formatos."""
+# Função para extrair áudio de vídeos de maneira robusta
+def extract_audio_from_video(video_path):
+    """Extrai o áudio de um vídeo como PCM 16 kHz mono, lido direto do pipe do ffmpeg, com suporte a múltiplos formatos."""
     try:
-        acquire_lock()  # Adquirir o lock antes de usar a GPU
-        
-        # Verifica o formato e codecs do vídeo
-        ffprobe_command = [
-            'ffprobe', 
-            '-v', 'error', 
-            '-select_streams', 'a:0', 
-            '-show_entries', 'stream=codec_name', 
-            '-of', 'default=noprint_wrappers=1:nokey=1', 
-            video_path
-        ]
-        result = subprocess.run(ffprobe_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        audio_codec = result.stdout.strip()
-        logging.info(f"Codec de áudio detectado: {audio_codec}")
-
-        # Se o codec de áudio não for suportado, tenta reencapsular o arquivo para um formato compatível
-        if audio_codec not in ['aac', 'mp3', 'pcm_s16le']:
-            logging.warning(f"Codec de áudio {audio_codec} pode ser incompatível, reencapsulando para formato compatível.")
-            reencapsulated_path = video_path.replace('.mp4', '_reencapsulated.mp4')
-            reencapsulate_command = [
-                'ffmpeg', '-i', video_path, '-c:v', 'copy', '-c:a', 'aac', reencapsulated_path
-            ]
-            subprocess.run(reencapsulate_command, check=True)
-            video_path = reencapsulated_path
-            logging.info(f"Arquivo reencapsulado com sucesso: {reencapsulated_path}")
-
-        # Extração do áudio para WAV com parâmetros ajustados
-        command = [
-            'ffmpeg', '-i', video_path, '-vn', '-acodec', 'pcm_s16le', '-ar', '44100', '-ac', '2', audio_output_path
-        ]
-        subprocess.run(command, shell=False, check=True)
-        logging.info(f"Áudio extraído com sucesso de {video_path} para {audio_output_path}.")
+        acquire_gpu_lock()  # Adquirir o lock antes de usar a GPU
+
+        # O ffmpeg decodifica qualquer codec de áudio (AAC, Opus, Vorbis...) direto para PCM, sem reencapsular o vídeo
+        with timing.measure('extraction'):
+            pcm = decode_pcm(video_path)
+        logging.info(f"Áudio extraído com sucesso de {video_path} ({len(pcm) / SAMPLE_RATE:.2f}s).")
+        return pcm
         
     except subprocess.CalledProcessError as e:
         logging.error(f"Erro ao extrair áudio de {video_path}: {e}")
         raise
     finally:
-        release_lock()  # Libera o lock após o uso da GPU
+        release_gpu_lock()  # Libera o lock após o uso da GPU
 
 
 
-# Função para remover o arquivo de vídeo após extração
-def remove_file(file_path):
-    """Remove o arquivo especificado."""
-    if os.path.exists(file_path):
-        os.remove(file_path)
-        logging.info(f"Arquivo {file_path} removido com sucesso.")
-    else:
-        logging.warning(f"Arquivo {file_path} não encontrado para remoção.")
-
 # Função que decide se o arquivo é áudio ou vídeo e processa adequadamente
-def handle_media(media_path, request_folder, config):
-    """Processa arquivos de áudio ou vídeo para transcrição."""
+def handle_media(media_path, request_folder, config, on_segment=None):
+    """Decodifica o áudio do arquivo e o transcreve; devolve (sucesso, estatísticas do VAD)."""
     file_ext = os.path.splitext(media_path)[-1].lower()
+    name = os.path.splitext(os.path.basename(media_path))[0]
+    media_bytes = os.path.getsize(media_path)
+    extraction_start = time.time()
 
-    if file_ext in ['.mp4', '.mkv', '.avi']:
+    if file_ext in VIDEO_EXTENSIONS:
         # Tratamento de vídeo: extrair áudio
-        audio_output_path = media_path.replace(file_ext, '.wav')
-        extract_audio_from_video(media_path, audio_output_path)
-        
-        # Remover o vídeo após a extração do áudio
-        remove_file(media_path)
-        
-        # Chamar a transcrição com o áudio extraído
-        transcribe_audio(audio_output_path, request_folder, config)
-        
-        # Remover o arquivo de áudio após a transcrição, se necessário
-        if config.get('remove_audio_after_transcription', False):
-            remove_file(audio_output_path)
-
-    elif file_ext in ['.wav', '.mp3', '.aac']:
-        # Tratamento de áudio direto: transcrever
-        transcribe_audio(media_path, request_folder, config)
+        # O vídeo fica em disco até o fim do job (process_job o remove), para que uma nova tentativa após
+        # uma queda do processo ainda encontre o arquivo
+        pcm = extract_audio_from_video(media_path)
+    elif file_ext in AUDIO_EXTENSIONS:
+        # Tratamento de áudio direto (inclui as mensagens de voz .ogg/.opus do WhatsApp): decodificar para PCM
+        with timing.measure('extraction'):
+            pcm = decode_pcm(media_path)
     else:
         logging.error(f"Formato de arquivo não suportado: {file_ext}")
         raise ValueError(f"Formato de arquivo não suportado: {file_ext}")
+    EXTRACTION_SECONDS.observe(time.time() - extraction_start)
+    EXTRACTION_BYTES.inc(media_bytes)
+
+    # Mantém o áudio decodificado em disco apenas quando configurado
+    if SAVE_EXTRACTED_AUDIO and not config.get('remove_audio_after_transcription', False):
+        write_wav(os.path.join(request_folder, name + '.wav'), pcm)
+
+    return prefilter_and_transcribe(pcm, name, request_folder, config, on_segment)
+
+# Função que descarta áudios silenciosos e corta silêncios longos antes de chamar o modelo
+def prefilter_and_transcribe(pcm, name, request_folder, config, on_segment=None):
+    """Aplica o pré-filtro de VAD sobre o PCM decodificado e transcreve apenas o trecho com fala."""
+    if not vad.VAD_ENABLED:
+        return transcribe_speech(pcm, 0.0, name, request_folder, config, on_segment), None
+
+    with timing.measure('vad'):
+        stats = vad.analyze(pcm)
+    removed = vad.describe_removed(stats)
+
+    if stats['silent']:
+        # Sem fala: não há por que carregar o modelo; finalize_transcription gera o HTML "sem conteúdo".
+        # Devolve False para que esse resultado, que não passou pelo modelo, nunca vá para o cache
+        logging.info(f"Áudio silencioso descartado pelo VAD: {name} ({removed['duration']:.2f}s)")
+        return False, removed
+
+    if removed['removed_seconds'] > 0:
+        logging.info(f"VAD removeu {removed['removed_seconds']:.2f}s de silêncio de {name}")
+
+    # As legendas são reposicionadas no tempo do áudio original pelo deslocamento do corte inicial
+    speech = pcm[stats['start']:stats['end']]
+    offset_seconds = stats['start'] / SAMPLE_RATE
+    return transcribe_speech(speech, offset_seconds, name, request_folder, config, on_segment), removed
+
+# Função que escolhe entre a transcrição direta e a transcrição em trechos paralelos
+def transcribe_speech(pcm, offset_seconds, name, request_folder, config, on_segment=None):
+    # Áudios longos são divididos nos silêncios e transcritos em paralelo
+    if len(pcm) > chunked_transcription.LONG_AUDIO_SECONDS * SAMPLE_RATE:
+        return transcribe_long_audio(pcm, offset_seconds, name, request_folder, config, on_segment)
+    return transcribe_audio(pcm, offset_seconds, name, request_folder, config, on_segment)
 
         
 def is_srt_valid(srt_path):
@@ -139,65 +298,85 @@ def is_srt_valid(srt_path):
     except Exception as e:
         logging.error(f"Erro ao validar o arquivo SRT: {e}")
         return False
-# Função para transcrever o áudio (mesma função existente)
-def transcribe_audio(audio_path, request_folder, config):
+# Função para transcrever o áudio decodificado
+def transcribe_audio(pcm, offset_seconds, name, request_folder, config, on_segment=None):
     start_time = time.time()  # Marca o início da transcrição
     
     try:
-        acquire_lock()  # Adquirir o lock antes de utilizar a GPU
-
-        # Configuração base do comando
-        command = [
-            FASTER_WHISPER_PATH,
-            audio_path,
-            '--language', 'Portuguese',
-            '--model', config.get('model', 'medium'),  # Modelo configurável
-            '--output_dir', request_folder
-        ]
-
-        # Adiciona beam_size se configurado
-        if config.get('beam_size'):
-            command.extend(['--beam_size', str(config['beam_size'])])
-
-        # Adiciona chunking se configurado
-        if config.get('chunk_length'):
-            command.extend(['--chunk_length', str(config['chunk_length'])])
-        
-        # Adiciona torch_dtype se configurado
-        if config.get('torch_dtype'):
-            command.extend(['--torch_dtype', config['torch_dtype']])
-        
-        logging.info(f"Executando comando: {' '.join(command)}")
-        subprocess.run(command, check=True)
+        acquire_gpu_lock()  # Adquirir o lock antes de utilizar a GPU
+
+        # Usa o modelo residente em memória quando disponível; o executável fica como alternativa
+        whisper_backend.transcribe_pcm(pcm, name, request_folder, config, FASTER_WHISPER_PATH,
+                                       UPLOAD_FOLDER, offset_seconds, on_segment)
         logging.info(f"Transcrição concluída e salva em {request_folder}")
         
         # Marca o fim da transcrição e calcula o tempo total
         end_time = time.time()
         elapsed_time = end_time - start_time
         logging.info(f"Tempo total de transcrição: {elapsed_time:.2f} segundos")
+        observe_real_time_factor(elapsed_time, pcm, config)
         
         return True
     except subprocess.CalledProcessError as e:
         logging.error(f"Erro durante a transcrição: {e}")
         return False
     finally:
-        release_lock()  # Libera o lock após finalizar o uso da GPU
+        release_gpu_lock()  # Libera o lock após finalizar o uso da GPU
+
+
+# Função para registrar o fator de tempo real (tempo de transcrição / duração do áudio)
+def observe_real_time_factor(elapsed_time, pcm, config):
+    audio_seconds = len(pcm) / SAMPLE_RATE
+    if audio_seconds > 0:
+        REAL_TIME_FACTOR.observe(elapsed_time / audio_seconds, model=config.get('model') or 'medium')
+        adaptive_policy.observe(config.get('model') or 'medium', config.get('beam_size'), elapsed_time, audio_seconds)
+
+# Função para transcrever áudios longos em trechos paralelos
+def transcribe_long_audio(pcm, offset_seconds, name, request_folder, config, on_segment=None):
+    """Transcreve o PCM em trechos paralelos e grava um único SRT nos tempos do áudio original."""
+    start_time = time.time()  # Marca o início da transcrição
+    srt_path = os.path.join(request_folder, name + '.srt')
+
+    try:
+        acquire_gpu_lock()  # Adquirir o lock antes de utilizar a GPU
+        # Os trechos rodam em outros processos; o tempo de carga dos modelos entra em 'inference'
+        with timing.measure('inference'):
+            chunked_transcription.transcribe_in_chunks(pcm, srt_path, config, FASTER_WHISPER_PATH,
+                                                       offset_seconds, work_dir=UPLOAD_FOLDER,
+                                                       on_segment=on_segment)
+        logging.info(f"Transcrição em trechos concluída e salva em {srt_path}")
+
+        elapsed_time = time.time() - start_time
+        logging.info(f"Tempo total de transcrição: {elapsed_time:.2f} segundos")
+        observe_real_time_factor(elapsed_time, pcm, config)
+        return True
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Erro durante a transcrição em trechos: {e}")
+        return False
+    finally:
+        release_gpu_lock()  # Libera o lock após finalizar o uso da GPU
 
 
 # Rota para upload do arquivo de áudio ou vídeo com diferentes configurações
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    if 'file' not in request.files:
+    timer = timing.StageTimer()
+    # O corpo da requisição é lido (e gravado no spool) no primeiro acesso a request.files
+    with timer.measure('upload_receive'):
+        has_file = 'file' in request.files
+    if not has_file:
         return jsonify({"error": "Nenhum arquivo enviado"}), 400
 
     file = request.files['file']
     if file.filename == '':
+        discard_upload(file)
         return jsonify({"error": "Nenhum arquivo selecionado"}), 400
 
     user_id = request.form.get('user_id')
     request_id = request.form.get('request_id')
 
     if not user_id or not request_id:
+        discard_upload(file)
         return jsonify({"error": "ID de usuário ou de requisição ausente"}), 400
 
     # Configurações opcionais para as variações
@@ -209,63 +388,245 @@ def upload_file():
         'remove_audio_after_transcription': request.form.get('remove_audio_after_transcription', 'false').lower() == 'true'
     }
 
-    # Salva o arquivo na pasta de uploads
+    # Modo assíncrono: devolve o ID do job imediatamente, sem aguardar a transcrição
+    async_mode = request.form.get('async', 'false').lower() == 'true'
+
+    # Com adaptive=false o job usa exatamente o modelo e o beam pedidos, mesmo com a fila cheia
+    adaptive_mode = request.form.get('adaptive', 'true').lower() == 'true'
+
     file_ext = os.path.splitext(file.filename)[-1].lower()
-    if file_ext not in ['.mp4', '.mkv', '.avi', '.wav', '.mp3', '.aac']:
+    if file_ext not in VIDEO_EXTENSIONS + AUDIO_EXTENSIONS:
+        discard_upload(file)
         return jsonify({"error": f"Formato de arquivo não suportado: {file_ext}"}), 400
 
-    file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-    file.save(file_path)
+    # O arquivo já foi gravado em blocos, com nome único, durante a leitura da requisição
+    with timer.measure('spool'):
+        file_path, audio_hash = take_spooled_upload(file)
 
     # Cria os diretórios do usuário e da requisição
     request_folder = create_directories(user_id, request_id)
 
-    # Adiciona a transcrição à fila
+    job = job_registry.create(user_id, request_id, config, timer)
+
+    # Áudios repetidos (ex.: mensagens encaminhadas) são servidos do cache, sem passar pelo modelo
+    cache_key = make_cache_key(audio_hash, config)
+    with timer.measure('cache_lookup'):
+        cached_result = restore_from_cache(cache_key, request_folder, request_id)
+    if cached_result is not None:
+        os.remove(file_path)
+        cached_result['effective_config'] = config
+        cached_result['timing'] = save_timing(timer, request_folder, request_id)
+        # Persistido como os demais jobs, para que /jobs/<job_id> continue respondendo após um reinício
+        job_store.record_completed(job.id, user_id, request_id, cached_result)
+        job_registry.mark_running(job.id)
+        job_registry.complete(job.id, cached_result)
+        JOB_OUTCOMES.inc(outcome='cached')
+        if async_mode:
+            return jsonify({
+                "message": "Transcrição obtida do cache",
+                "job_id": job.id,
+                "status_url": f"/jobs/{job.id}"
+            }), 202
+        return jsonify(cached_result)
+
+    # A duração (lida do contêiner, sem decodificar) define a prioridade do job na fila
+    with timer.measure('probe'):
+        audio_seconds = probe_duration(file_path)
+
+    # Com a fila longa, usa um modelo/beam mais rápido para manter a latência dentro do SLO
+    effective_config = config
+    if adaptive.ADAPTIVE_QUALITY and adaptive_mode:
+        effective_config, estimate = adaptive_policy.choose(config, scheduler.queue.qsize(), scheduler.workers,
+                                                            audio_seconds)
+        if effective_config is not config:
+            logging.info(f"Job {job.id} rebaixado para {effective_config['model']} (beam {effective_config['beam_size']}); "
+                         f"latência estimada {estimate:.1f}s")
+            ADAPTIVE_DOWNGRADES.inc(requested_model=config['model'], effective_model=effective_config['model'])
+            # O resultado é guardado no cache sob a configuração realmente usada
+            cache_key = make_cache_key(audio_hash, effective_config)
+
+    # Grava o job na fila persistente e o adiciona à fila em memória
+    task = {
+        'job_id': job.id,
+        'user_id': user_id,
+        'audio_seconds': audio_seconds,
+        'media_path': file_path,
+        'request_folder': request_folder,
+        'config': effective_config,
+        'requested_config': config,
+        'cache_key': cache_key,
+        'enqueued_at': time.time()
+    }
+    job_store.enqueue(job.id, user_id, request_id, task)
+    scheduler.submit(task)
+
+    if async_mode:
+        return jsonify({
+            "message": "Transcrição adicionada à fila",
+            "job_id": job.id,
+            "status_url": f"/jobs/{job.id}",
+            "effective_config": effective_config
+        }), 202
+
+    # Espera apenas a conclusão deste job (e não o esvaziamento da fila inteira)
+    job = wait_for_job(job.id, SYNC_WAIT_SECONDS)
+    if not job.finished:
+        return jsonify({
+            "error": "Tempo de espera esgotado; a transcrição continua na fila",
+            "job_id": job.id,
+            "status_url": f"/jobs/{job.id}"
+        }), 504
+    if job.error:
+        return jsonify({"error": job.error}), 500
+    return jsonify(job.result)
+
+# Rota para consultar o status e o resultado de um job (com suporte a long-poll via ?wait=<segundos>)
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
     try:
-        with queue_lock:
-            transcription_queue.put((file_path, request_folder, config))
+        wait_seconds = float(request.args.get('wait', 0))
+    except ValueError:
+        return jsonify({"error": "Parâmetro 'wait' inválido"}), 400
 
-        # Espera o processamento da fila para garantir a conclusão
-        transcription_queue.join()
+    wait_seconds = min(max(wait_seconds, 0), MAX_LONG_POLL_SECONDS)
+    if wait_seconds > 0:
+        job = wait_for_job(job_id, wait_seconds)
+    else:
+        job = sync_job_from_store(job_id)
+
+    if job is None:
+        # Jobs de antes de um reinício só existem na fila persistente
+        stored = job_store.get(job_id)
+        if stored is None:
+            return jsonify({"error": "Job não encontrado"}), 404
+        return jsonify(stored)
+    return jsonify(job.to_dict())
+
+# Rota que transmite (Server-Sent Events) os segmentos de um job à medida que são decodificados
+@app.route('/jobs/<job_id>/stream', methods=['GET'])
+def stream_job(job_id):
+    if job_registry.get(job_id) is None:
+        return jsonify({"error": "Job não encontrado"}), 404
+
+    # Clientes que reconectam retomam a partir do último segmento recebido
+    try:
+        cursor = int(request.headers.get('Last-Event-ID', -1)) + 1
+    except ValueError:
+        cursor = 0
+
+    def generate():
+        nonlocal cursor
+        while True:
+            job, segments = job_registry.wait_for_segments(job_id, cursor, timeout=SSE_HEARTBEAT_SECONDS)
+            if job is None:
+                yield sse_event('error', {"error": "Job não encontrado"})
+                return
+            for segment in segments:
+                yield sse_event('segment', segment, event_id=cursor)
+                cursor += 1
+            if job.finished and cursor >= len(job.segments):
+                if job.error:
+                    yield sse_event('error', {"error": job.error})
+                else:
+                    yield sse_event('done', job.result)
+                return
+            if not segments:
+                sync_job_from_store(job_id)
+                yield ': keep-alive\n\n'
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+
+# Função para formatar um evento SSE
+def sse_event(event, data, event_id=None):
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+# Rota com as métricas no formato do Prometheus
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+# Rota para visualizar a profundidade da fila e a utilização dos workers de transcrição
+@app.route('/scheduler_status', methods=['GET'])
+def scheduler_status():
+    stats = scheduler.stats()
+    stats['adaptive'] = adaptive_policy.stats()
+    return jsonify(stats)
+
+# Rota para visualizar as estatísticas do cache de transcrições
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify(transcription_cache.stats())
+
+# Função para recuperar uma transcrição do cache para a pasta da requisição
+def restore_from_cache(cache_key, request_folder, request_id):
+    """Copia o SRT e o HTML do cache para a pasta da requisição; devolve None em caso de miss."""
+    srt_path = os.path.join(request_folder, f'{request_id}.srt')
+    html_path = os.path.join(request_folder, f'{request_id}.html')
+    has_srt = transcription_cache.get(cache_key, srt_path, html_path)
+    if has_srt is None:
+        return None
+
+    if has_srt:
+        return {
+            "message": "Transcrição concluída com sucesso",
+            "srt_path": srt_path,
+            "html_path": html_path,
+            "cached": True
+        }
+
+    no_transcription_path = os.path.join(request_folder, f'{request_id}_no_transcription.html')
+    os.replace(html_path, no_transcription_path)
+    return {
+        "message": "Nenhum conteúdo transcritível detectado",
+        "srt_path": None,
+        "html_path": no_transcription_path,
+        "cached": True
+    }
 
-        # Renomeia o arquivo SRT gerado
-        srt_path = os.path.join(request_folder, f'{request_id}.srt')
+# Função para renomear o SRT gerado, validar o conteúdo e gerar o HTML
+def finalize_transcription(request_folder, request_id):
+    """Renomeia o SRT gerado, valida o conteúdo e gera o HTML correspondente."""
+    # Renomeia o arquivo SRT gerado
+    srt_path = os.path.join(request_folder, f'{request_id}.srt')
+    with timing.measure('srt_rename'):
         srt_file_path = find_file_by_extension(request_folder, ".srt")
         if srt_file_path:
             os.rename(srt_file_path, srt_path)
 
-        # Verifica se o SRT contém texto válido
-        if os.path.exists(srt_path) and is_srt_valid(srt_path):
-            # Gera o HTML em formato de parágrafo único a partir do SRT
-            html_path = os.path.join(request_folder, f'{request_id}.html')
-            if not generate_html_paragraph(srt_path, html_path):
-                raise Exception("Falha ao gerar o HTML")
-
-            return jsonify({
-                "message": "Transcrição concluída com sucesso",
-                "srt_path": srt_path,
-                "html_path": html_path
-            })
-        else:
-            logging.error(f"Arquivo SRT vazio ou inválido para a requisição {request_id}")
-            # Gera um HTML indicando que não há conteúdo transcritível
-            html_path = os.path.join(request_folder, f'{request_id}_no_transcription.html')
-            with open(html_path, 'w', encoding='utf-8') as f:
-                f.write("<html><body><p>Sem conteúdo transcritível detectado.</p></body></html>")
-            
-            return jsonify({
-                "message": "Nenhum conteúdo transcritível detectado",
-                "srt_path": None,
-                "html_path": html_path
-            })
-
-    except Exception as e:
-        logging.error(f"Erro inesperado: {e}")
-        return jsonify({"error": f"Erro inesperado: {str(e)}"}), 500
+    # Verifica se o SRT contém texto válido
+    with timing.measure('validation'):
+        valid = os.path.exists(srt_path) and is_srt_valid(srt_path)
+    if valid:
+        # Gera o HTML em formato de parágrafo único a partir do SRT
+        html_path = os.path.join(request_folder, f'{request_id}.html')
+        with timing.measure('html_render'):
+            rendered = generate_html_paragraph(srt_path, html_path)
+        if not rendered:
+            raise Exception("Falha ao gerar o HTML")
+
+        return {
+            "message": "Transcrição concluída com sucesso",
+            "srt_path": srt_path,
+            "html_path": html_path
+        }
+
+    logging.error(f"Arquivo SRT vazio ou inválido para a requisição {request_id}")
+    # Gera um HTML indicando que não há conteúdo transcritível
+    html_path = os.path.join(request_folder, f'{request_id}_no_transcription.html')
+    with timing.measure('html_render'), open(html_path, 'w', encoding='utf-8') as f:
+        f.write("<html><body><p>Sem conteúdo transcritível detectado.</p></body></html>")
+
+    return {
+        "message": "Nenhum conteúdo transcritível detectado",
+        "srt_path": None,
+        "html_path": html_path
+    }
 
-    finally:
-        if os.path.exists(file_path):
-            os.remove(file_path)
 # Função para criar os diretórios do usuário e da requisição
 def create_directories(user_id, request_id):
     """Cria os diretórios do usuário e da requisição, se não existirem."""
@@ -327,4 +688,6 @@ def serve_transcriptions(subpath):
         return jsonify({"error": "Caminho não encontrado"}), 404
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5502)
+    start_services()
+    # Sem o reloader: o processo pai dele também executaria este bloco e disputaria os jobs com o filho
+    app.run(debug=True, use_reloader=False, host='0.0.0.0', port=5502)
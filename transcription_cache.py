@@ -0,0 +1,120 @@
+import os
+import time
+import shutil
+import hashlib
+import sqlite3
+import logging
+import threading
+
+CACHE_FOLDER = 'cache'
+
+# Tamanho máximo do cache em disco (MB); as entradas menos usadas recentemente são descartadas
+TRANSCRIPTION_CACHE_MAX_MB = int(os.environ.get('TRANSCRIPTION_CACHE_MAX_MB', 1024))
+
+# Parâmetros de decodificação que fazem parte da chave do cache
+CACHE_CONFIG_KEYS = ('model', 'beam_size', 'chunk_length', 'torch_dtype')
+
+def make_cache_key(audio_hash, config):
+    """Combina o hash do áudio com a configuração de decodificação."""
+    parts = [audio_hash] + [f"{name}={config.get(name) or ''}" for name in CACHE_CONFIG_KEYS]
+    return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+class TranscriptionCache:
+    """Cache persistente de transcrições endereçado pelo conteúdo do áudio, com descarte LRU por tamanho."""
+
+    def __init__(self, folder=CACHE_FOLDER, max_bytes=TRANSCRIPTION_CACHE_MAX_MB * 1024 * 1024):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        os.makedirs(folder, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(folder, 'index.db'), check_same_thread=False)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                has_srt INTEGER,
+                size INTEGER,
+                last_access REAL
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries (last_access)')
+        self._conn.commit()
+
+    def get(self, key, srt_dest, html_dest):
+        """Copia o SRT e o HTML guardados para os destinos; devolve (tem_srt) ou None em caso de miss."""
+        with self._lock:
+            row = self._conn.execute('SELECT has_srt FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            # A cópia acontece com o lock, para que um descarte concorrente não apague os arquivos no meio dela
+            has_srt = bool(row[0])
+            try:
+                if has_srt:
+                    shutil.copyfile(self._path(key, '.srt'), srt_dest)
+                shutil.copyfile(self._path(key, '.html'), html_dest)
+            except FileNotFoundError:
+                # Arquivos removidos fora do cache: a entrada é descartada e a consulta conta como miss
+                logging.warning(f"Arquivos da entrada {key} ausentes no cache; descartando a entrada")
+                self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                self._conn.commit()
+                self.misses += 1
+                return None
+
+            self._conn.execute('UPDATE entries SET last_access = ? WHERE key = ?', (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+        return has_srt
+
+    def put(self, key, srt_path, html_path):
+        """Guarda o resultado de uma transcrição (srt_path é None quando não houve conteúdo transcritível)."""
+        try:
+            size = 0
+            if srt_path:
+                shutil.copyfile(srt_path, self._path(key, '.srt'))
+                size += os.path.getsize(srt_path)
+            shutil.copyfile(html_path, self._path(key, '.html'))
+            size += os.path.getsize(html_path)
+        except OSError as e:
+            logging.error(f"Falha ao gravar a transcrição no cache: {e}")
+            return
+
+        with self._lock:
+            self._conn.execute('''
+                INSERT OR REPLACE INTO entries (key, has_srt, size, last_access)
+                VALUES (?, ?, ?, ?)
+            ''', (key, 1 if srt_path else 0, size, time.time()))
+            self._conn.commit()
+            self._evict()
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": entries,
+                "size_bytes": size,
+                "max_bytes": self.max_bytes
+            }
+
+    def _path(self, key, extension):
+        return os.path.join(self.folder, key + extension)
+
+    def _evict(self):
+        """Remove as entradas menos usadas recentemente até respeitar o tamanho máximo."""
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute('SELECT key, size FROM entries ORDER BY last_access').fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            for extension in ('.srt', '.html'):
+                if os.path.exists(self._path(key, extension)):
+                    os.remove(self._path(key, extension))
+            total -= size
+        self._conn.commit()
@@ -0,0 +1,87 @@
+import os
+import uuid
+import hashlib
+
+from flask import Request, current_app, request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+# Tamanho máximo aceito por upload (MB)
+MAX_UPLOAD_MB = int(os.environ.get('MAX_UPLOAD_MB', 200))
+
+
+class HashingSpoolFile:
+    """Arquivo de spool com nome único que calcula o SHA-256 à medida que o upload é gravado."""
+
+    def __init__(self, folder, extension, max_bytes=None):
+        self.path = os.path.join(folder, uuid.uuid4().hex + extension)
+        self.size = 0
+        self.max_bytes = max_bytes
+        self.taken = False  # entregue ao worker por take_spooled_upload; não é removido no fim da requisição
+        self._digest = hashlib.sha256()
+        self._file = open(self.path, 'w+b')
+
+    def write(self, data):
+        self.size += len(data)
+        # Rejeita assim que o limite é ultrapassado, sem esperar o fim do corpo da requisição
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            self.discard()
+            raise RequestEntityTooLarge()
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+    def discard(self):
+        """Fecha e remove o arquivo de spool."""
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class SpoolingRequest(Request):
+    """Request que grava os arquivos enviados direto em UPLOAD_FOLDER, em blocos, enquanto o corpo é lido."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Todas as partes com arquivo são gravadas em spool, não só a 'file'
+        self.spooled_files = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        extension = os.path.splitext(filename or '')[-1].lower()
+        spool = HashingSpoolFile(current_app.config['UPLOAD_FOLDER'], extension,
+                                 current_app.config.get('MAX_CONTENT_LENGTH'))
+        self.spooled_files.append(spool)
+        return spool
+
+
+def discard_untaken_spools(exc=None):
+    """Remove, ao fim da requisição, os spools que nenhuma rota entregou ao worker."""
+    for spool in getattr(request, 'spooled_files', ()):
+        if not spool.taken:
+            spool.discard()
+
+
+def configure_spooling(app, upload_folder, max_upload_mb=MAX_UPLOAD_MB):
+    """Ativa o spool de uploads na aplicação Flask."""
+    app.request_class = SpoolingRequest
+    app.teardown_request(discard_untaken_spools)
+    app.config['UPLOAD_FOLDER'] = upload_folder
+    # Requisições com Content-Length acima do limite são recusadas antes de qualquer leitura
+    app.config['MAX_CONTENT_LENGTH'] = max_upload_mb * 1024 * 1024
+
+
+def take_spooled_upload(file):
+    """Fecha o spool de um upload e devolve (caminho, sha256) para entregá-lo ao worker sem cópia."""
+    file.stream.close()
+    file.stream.taken = True
+    return file.stream.path, file.stream.hexdigest()
+
+
+def discard_upload(file):
+    """Remove o spool de um upload rejeitado."""
+    if isinstance(file.stream, HashingSpoolFile):
+        file.stream.discard()
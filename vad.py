@@ -0,0 +1,110 @@
+import os
+
+import numpy as np
+
+from audio_decode import SAMPLE_RATE
+
+# Desative (VAD_ENABLED=false) para enviar todos os arquivos ao modelo sem pré-filtro
+VAD_ENABLED = os.environ.get('VAD_ENABLED', 'true').lower() == 'true'
+
+FRAME_MS = 30
+
+# Quadros abaixo deste nível (dBFS) são silêncio; é o único critério para descartar um arquivo inteiro
+ABSOLUTE_THRESHOLD_DB = -50.0
+
+# Margem acima do ruído de fundo (percentil 10 da energia) usada só para cortar silêncios nas pontas
+NOISE_MARGIN_DB = 12.0
+
+# Menos fala que isso (em segundos) classifica o arquivo como silencioso
+MIN_SPEECH_SECONDS = 0.3
+
+# Silêncios iniciais/finais maiores que isso são cortados, preservando PADDING_SECONDS de margem
+LONG_SILENCE_SECONDS = 1.0
+PADDING_SECONDS = 0.3
+
+# Quadros processados por vez, para limitar a memória em áudios longos
+FRAMES_PER_BLOCK = 8192
+
+
+def frame_energies_db(pcm, sample_rate=SAMPLE_RATE, frame_ms=FRAME_MS):
+    """Energia RMS (dBFS) de cada quadro do PCM int16, calculada de forma vetorizada."""
+    frame_length = int(sample_rate * frame_ms / 1000)
+    frame_count = len(pcm) // frame_length
+    frames = pcm[:frame_count * frame_length].reshape(frame_count, frame_length)
+
+    energies = np.empty(frame_count, dtype=np.float32)
+    for start in range(0, frame_count, FRAMES_PER_BLOCK):
+        block = frames[start:start + FRAMES_PER_BLOCK].astype(np.float32) / 32768.0
+        energies[start:start + FRAMES_PER_BLOCK] = np.sqrt(np.mean(block * block, axis=1))
+    return 20.0 * np.log10(np.maximum(energies, 1e-10))
+
+
+def speech_mask(energies):
+    """Máscara dos quadros com som acima do limiar absoluto (decide se o arquivo é silencioso)."""
+    return energies > ABSOLUTE_THRESHOLD_DB
+
+
+def trim_mask(energies):
+    """Máscara dos quadros que se destacam do ruído de fundo, usada para localizar as pontas a cortar.
+
+    Em áudios de nível constante (fala contínua, tom) nenhum quadro se destaca; nesse caso vale a
+    máscara absoluta e nada é cortado por ser "ruído".
+    """
+    noise_floor = np.percentile(energies, 10)
+    mask = energies > max(ABSOLUTE_THRESHOLD_DB, noise_floor + NOISE_MARGIN_DB)
+    return mask if mask.any() else speech_mask(energies)
+
+
+def analyze(pcm, sample_rate=SAMPLE_RATE):
+    """Classifica o áudio e calcula o trecho a ser mantido após cortar silêncios longos nas pontas.
+
+    Devolve um dicionário com a duração total, segundos de fala, se o áudio é silencioso e
+    os índices de amostra (start, end) do trecho a transcrever.
+    """
+    frame_length = int(sample_rate * FRAME_MS / 1000)
+    duration = len(pcm) / sample_rate
+    energies = frame_energies_db(pcm, sample_rate)
+    mask = speech_mask(energies)
+    speech_seconds = float(np.count_nonzero(mask)) * FRAME_MS / 1000
+
+    stats = {
+        "duration": round(duration, 3),
+        "speech_seconds": round(speech_seconds, 3),
+        "silent": bool(speech_seconds < MIN_SPEECH_SECONDS),
+        "start": 0,
+        "end": len(pcm)
+    }
+    if stats["silent"]:
+        return stats
+
+    speech_frames = np.flatnonzero(trim_mask(energies))
+    padding = int(PADDING_SECONDS * sample_rate)
+    leading = int(speech_frames[0]) * frame_length
+    trailing = len(pcm) - (int(speech_frames[-1]) + 1) * frame_length
+
+    if leading > LONG_SILENCE_SECONDS * sample_rate:
+        stats["start"] = max(0, leading - padding)
+    if trailing > LONG_SILENCE_SECONDS * sample_rate:
+        stats["end"] = min(len(pcm), len(pcm) - trailing + padding)
+    return stats
+
+
+def describe_removed(stats, sample_rate=SAMPLE_RATE):
+    """Resumo do áudio removido pelo pré-filtro, para registro no resultado do job."""
+    total = stats["duration"]
+    if stats["silent"]:
+        removed = total
+        leading = total
+        trailing = 0.0
+    else:
+        leading = stats["start"] / sample_rate
+        trailing = total - stats["end"] / sample_rate
+        removed = leading + trailing
+    return {
+        "duration": total,
+        "speech_seconds": stats["speech_seconds"],
+        "silent": stats["silent"],
+        "leading_trimmed": round(leading, 3),
+        "trailing_trimmed": round(trailing, 3),
+        "removed_seconds": round(removed, 3)
+    }
@@ -0,0 +1,353 @@
+import os
+import re
+import sys
+import logging
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import pysrt
+
+import timing
+from audio_decode import pcm_to_float32, write_wav
+
+try:
+    from faster_whisper import WhisperModel
+except ImportError:  # O backend em memória é opcional; sem ele usamos o executável
+    WhisperModel = None
+
+# Backend de transcrição: 'inprocess' (modelos residentes em memória) ou 'subprocess' (faster-whisper-xxl.exe)
+TRANSCRIPTION_BACKEND = os.environ.get('TRANSCRIPTION_BACKEND', 'inprocess')
+
+# Dispositivo usado pelos modelos em memória ('auto', 'cuda' ou 'cpu')
+WHISPER_DEVICE = os.environ.get('WHISPER_DEVICE', 'auto')
+
+# Threads de CPU usadas por cada transcrição em andamento
+WHISPER_CPU_THREADS = int(os.environ.get('WHISPER_CPU_THREADS', 4))
+
+# Número de transcrições que uma mesma instância de modelo pode executar em paralelo
+WHISPER_MODEL_WORKERS = int(os.environ.get('WHISPER_MODEL_WORKERS', 2))
+
+# Orçamento de memória (em MB) para os modelos mantidos carregados
+WHISPER_POOL_MEMORY_MB = int(os.environ.get('WHISPER_POOL_MEMORY_MB', 8192))
+
+WHISPER_LANGUAGE = 'pt'
+
+# Linha de segmento impressa pelo faster-whisper-xxl durante a transcrição
+SEGMENT_LINE = re.compile(r'^\[((?:\d+:)?\d+:\d+\.\d+) --> ((?:\d+:)?\d+:\d+\.\d+)\]\s*(.*)$')
+
+# Tamanho aproximado de cada modelo em float32 (MB), usado para respeitar o orçamento de memória
+MODEL_SIZES_MB = {
+    'tiny': 150,
+    'base': 300,
+    'small': 950,
+    'medium': 3000,
+    'large-v1': 6000,
+    'large-v2': 6000,
+    'large-v3': 6000,
+}
+
+# Fator aplicado ao tamanho do modelo conforme o compute type
+COMPUTE_TYPE_FACTORS = {
+    'float32': 1.0,
+    'float16': 0.5,
+    'bfloat16': 0.5,
+    'int8_float16': 0.3,
+    'int8': 0.25,
+}
+
+# Conversão do parâmetro torch_dtype recebido na API para o compute type do CTranslate2
+TORCH_DTYPE_TO_COMPUTE_TYPE = {
+    'float32': 'float32',
+    'float16': 'float16',
+    'bfloat16': 'bfloat16',
+    'int8': 'int8',
+    'int8_float16': 'int8_float16',
+}
+
+
+def in_process_enabled():
+    """Indica se o backend em memória está configurado e disponível."""
+    return TRANSCRIPTION_BACKEND == 'inprocess' and WhisperModel is not None
+
+
+def compute_type_for(config):
+    """Obtém o compute type a partir do torch_dtype da configuração."""
+    torch_dtype = config.get('torch_dtype')
+    if not torch_dtype:
+        return 'default'
+    return TORCH_DTYPE_TO_COMPUTE_TYPE.get(torch_dtype, 'default')
+
+
+def estimate_model_size_mb(model_name, compute_type):
+    """Estima a memória ocupada por um modelo carregado."""
+    size = MODEL_SIZES_MB.get(model_name, MODEL_SIZES_MB['large-v2'])
+    return int(size * COMPUTE_TYPE_FACTORS.get(compute_type, 0.5))
+
+
+class ModelPool:
+    """Mantém instâncias de WhisperModel carregadas, com descarte LRU dentro de um orçamento de memória."""
+
+    def __init__(self, memory_budget_mb=WHISPER_POOL_MEMORY_MB, device=WHISPER_DEVICE,
+                 cpu_threads=WHISPER_CPU_THREADS, num_workers=WHISPER_MODEL_WORKERS):
+        self.memory_budget_mb = memory_budget_mb
+        self.device = device
+        self.cpu_threads = cpu_threads
+        self.num_workers = num_workers
+        self._models = OrderedDict()  # (modelo, compute type) -> WhisperModel
+        self._in_use = {}
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    @contextmanager
+    def acquire(self, model_name, compute_type='default'):
+        """Empresta um modelo carregado (carregando-o se necessário) enquanto o bloco estiver ativo."""
+        key = (model_name, compute_type)
+        model = self._get_or_load(key)
+        try:
+            yield model
+        finally:
+            with self._lock:
+                self._in_use[key] -= 1
+
+    def loaded_models(self):
+        with self._lock:
+            return [{"model": key[0], "compute_type": key[1], "in_use": self._in_use.get(key, 0)}
+                    for key in self._models]
+
+    def used_memory_mb(self):
+        with self._lock:
+            return sum(estimate_model_size_mb(*key) for key in self._models)
+
+    def _get_or_load(self, key):
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                self._in_use[key] = self._in_use.get(key, 0) + 1
+                return self._models[key]
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        # Carrega fora do lock global para não bloquear as transcrições com outros modelos
+        with load_lock:
+            with self._lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+                    self._in_use[key] = self._in_use.get(key, 0) + 1
+                    return self._models[key]
+
+            model_name, compute_type = key
+            logging.info(f"Carregando modelo {model_name} ({compute_type}) em memória...")
+            with timing.measure('model_load'):
+                model = WhisperModel(model_name, device=self.device, compute_type=compute_type,
+                                     cpu_threads=self.cpu_threads, num_workers=self.num_workers)
+
+            with self._lock:
+                self._evict_for(estimate_model_size_mb(*key))
+                self._models[key] = model
+                self._in_use[key] = self._in_use.get(key, 0) + 1
+                return model
+
+    def _evict_for(self, needed_mb):
+        """Descarta os modelos menos usados recentemente até caber o novo modelo (ignora os em uso)."""
+        used = sum(estimate_model_size_mb(*key) for key in self._models)
+        for key in list(self._models):
+            if used + needed_mb <= self.memory_budget_mb:
+                break
+            if self._in_use.get(key, 0) > 0:
+                continue
+            del self._models[key]
+            self._in_use.pop(key, None)
+            used -= estimate_model_size_mb(*key)
+            logging.info(f"Modelo {key[0]} ({key[1]}) descartado da memória")
+
+
+model_pool = ModelPool()
+
+
+def format_srt_timestamp(seconds):
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    secs, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d},{milliseconds:03d}"
+
+
+def write_srt(segments, srt_path):
+    """Grava uma lista de segmentos (início, fim, texto) em formato SRT."""
+    with open(srt_path, 'w', encoding='utf-8') as f:
+        for index, (start, end, text) in enumerate(segments, start=1):
+            f.write(f"{index}\n{format_srt_timestamp(start)} --> {format_srt_timestamp(end)}\n{text.strip()}\n\n")
+
+
+def transcribe_to_srt(audio, output_dir, config, name=None, offset_seconds=0.0, on_segment=None):
+    """Transcreve com um modelo residente e grava o SRT em output_dir, como o executável faria.
+
+    audio pode ser o caminho de um arquivo ou um array float32 de 16 kHz mono; neste caso,
+    name define o nome do SRT. offset_seconds é somado aos tempos dos segmentos, e on_segment
+    (se informado) é chamado com (início, fim, texto) assim que cada segmento é decodificado.
+    """
+    model_name = config.get('model') or 'medium'
+    options = {'language': WHISPER_LANGUAGE}
+    if config.get('beam_size'):
+        options['beam_size'] = int(config['beam_size'])
+    if config.get('chunk_length'):
+        options['chunk_length'] = int(config['chunk_length'])
+
+    with model_pool.acquire(model_name, compute_type_for(config)) as model, timing.measure('inference'):
+        decoded, _ = model.transcribe(audio, **options)
+        # Os segmentos são gerados sob demanda; consumimos enquanto o modelo está emprestado
+        segments = []
+        for segment in decoded:
+            segments.append((segment.start + offset_seconds, segment.end + offset_seconds, segment.text))
+            if on_segment:
+                on_segment(*segments[-1])
+
+    if name is None:
+        name = os.path.splitext(os.path.basename(audio))[0]
+    srt_path = os.path.join(output_dir, name + '.srt')
+    write_srt(segments, srt_path)
+    return srt_path
+
+
+def executable_command(executable):
+    """Prefixo da linha de comando; scripts .py (como o stub_whisper.py) rodam com o Python atual."""
+    if executable.lower().endswith('.py'):
+        return [sys.executable, executable]
+    return [executable]
+
+
+def build_command(executable, audio_path, output_dir, config):
+    """Monta a linha de comando do faster-whisper-xxl para a configuração recebida."""
+    # Configuração base do comando
+    command = [
+        *executable_command(executable),
+        audio_path,
+        '--language', 'Portuguese',
+        '--model', config.get('model') or 'medium',  # Modelo configurável
+        '--output_dir', output_dir
+    ]
+
+    # Adiciona beam_size se configurado
+    if config.get('beam_size'):
+        command.extend(['--beam_size', str(config['beam_size'])])
+
+    # Adiciona chunking se configurado
+    if config.get('chunk_length'):
+        command.extend(['--chunk_length', str(config['chunk_length'])])
+
+    # Adiciona torch_dtype se configurado
+    if config.get('torch_dtype'):
+        command.extend(['--torch_dtype', config['torch_dtype']])
+    return command
+
+
+def parse_timestamp(value):
+    """Converte 'MM:SS.mmm' ou 'HH:MM:SS.mmm' em segundos."""
+    seconds = 0.0
+    for part in value.split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def run_executable(executable, audio_path, output_dir, config, on_segment=None):
+    """Transcreve com o faster-whisper-xxl; lança subprocess.CalledProcessError se ele falhar.
+
+    Com on_segment, a saída do executável é lida linha a linha e cada segmento impresso
+    ('[00:01.000 --> 00:03.500] texto') é repassado assim que aparece.
+    """
+    command = build_command(executable, audio_path, output_dir, config)
+    logging.info(f"Executando comando: {' '.join(command)}")
+    if on_segment is None:
+        subprocess.run(command, check=True)
+        return 0
+
+    emitted = 0
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               text=True, encoding='utf-8', errors='replace')
+    for line in process.stdout:
+        match = SEGMENT_LINE.match(line.strip())
+        if match:
+            on_segment(parse_timestamp(match.group(1)), parse_timestamp(match.group(2)), match.group(3))
+            emitted += 1
+        else:
+            logging.debug(line.rstrip())
+    if process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+    return emitted
+
+
+def transcribe_file(audio_path, output_dir, config, executable):
+    """Transcreve com o modelo residente em memória ou, como alternativa, com o executável.
+
+    Lança subprocess.CalledProcessError se o executável falhar.
+    """
+    if in_process_enabled():
+        try:
+            transcribe_to_srt(audio_path, output_dir, config)
+            return
+        except Exception as e:
+            logging.error(f"Falha no backend em memória, usando o executável: {e}")
+
+    # O executável carrega o modelo a cada chamada; esse tempo entra em 'inference'
+    with timing.measure('inference'):
+        run_executable(executable, audio_path, output_dir, config)
+
+
+def transcribe_pcm(pcm, name, output_dir, config, executable, work_dir, offset_seconds=0.0, on_segment=None):
+    """Transcreve PCM int16 de 16 kHz mono já decodificado, gravando <name>.srt em output_dir.
+
+    O modelo em memória recebe o PCM diretamente; só o executável precisa de um WAV temporário.
+    on_segment recebe (início, fim, texto) de cada segmento, já nos tempos do áudio original.
+    Se o modelo em memória falhar no meio do áudio, o executável recomeça do início e os segmentos
+    que terminam até o último já repassado não são enviados de novo.
+    """
+    streamed = []  # fim de cada segmento já repassado a on_segment
+    if in_process_enabled():
+        def forward(start, end, text):
+            streamed.append(end)
+            on_segment(start, end, text)
+
+        try:
+            transcribe_to_srt(pcm_to_float32(pcm), output_dir, config, name=name, offset_seconds=offset_seconds,
+                              on_segment=forward if on_segment else None)
+            return
+        except Exception as e:
+            logging.error(f"Falha no backend em memória, usando o executável: {e}")
+
+    def emit(start, end, text):
+        if not streamed or end > streamed[-1]:
+            on_segment(start, end, text)
+
+    shifted = None
+    if on_segment:
+        shifted = lambda start, end, text: emit(start + offset_seconds, end + offset_seconds, text)
+
+    # Nome único: <name>.wav em work_dir pode ser o próprio arquivo de entrada (uploads .wav)
+    fd, wav_path = tempfile.mkstemp(prefix=name + '_', suffix='.wav', dir=work_dir)
+    os.close(fd)
+    try:
+        with timing.measure('temp_wav'):
+            write_wav(wav_path, pcm)
+        # O executável carrega o modelo a cada chamada; esse tempo entra em 'inference'
+        with timing.measure('inference'):
+            emitted = run_executable(executable, wav_path, output_dir, config, on_segment=shifted)
+    finally:
+        os.remove(wav_path)
+
+    # O executável nomeia o SRT a partir do WAV temporário
+    generated_srt = os.path.join(output_dir, os.path.splitext(os.path.basename(wav_path))[0] + '.srt')
+    srt_path = os.path.join(output_dir, name + '.srt')
+    if not os.path.exists(generated_srt):
+        return
+    os.replace(generated_srt, srt_path)
+    subs = pysrt.open(srt_path, encoding='utf-8')
+    if offset_seconds:
+        # Reposiciona as legendas no tempo do áudio original
+        subs.shift(milliseconds=int(round(offset_seconds * 1000)))
+        subs.save(srt_path, encoding='utf-8')
+    if on_segment and not emitted:
+        # A saída do executável não trouxe os segmentos; repassa os do SRT gerado
+        for sub in subs:
+            emit(sub.start.ordinal / 1000, sub.end.ordinal / 1000, sub.text)